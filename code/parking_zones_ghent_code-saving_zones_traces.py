@@ -3,8 +3,12 @@
 # =============================================================================
 import requests
 import pandas as pd
+import numpy as np
 import geopandas as gpd
+import shapely
 import json
+import hashlib
+from datetime import datetime
 
 import plotly.express as px
 import plotly.io as pio
@@ -99,33 +103,145 @@ color_dict = {
     }
 
 # Create choropleth map
-choropleth_map = px.choropleth_mapbox(
-    dissolved_gdf,
-    geojson=dissolved_gdf.geometry,
-    locations=dissolved_gdf.index,  # Use GeoDataFrame index as locations
-    color="zone",
-    color_discrete_map=color_dict,  # Adjust color as needed
-    mapbox_style="carto-positron",
-    center={"lat": dissolved_gdf.geometry.centroid.y.mean(), "lon": dissolved_gdf.geometry.centroid.x.mean()},
-    zoom=11,
-    opacity=0.3,
-)
-   
-# Remove hover labels by setting hovermode to False
-choropleth_map.update_layout(hovermode=False)
+def get_choropleth_map(gdf):
+    choropleth_map = px.choropleth_mapbox(
+        gdf,
+        geojson=gdf.geometry,
+        locations=gdf.index,  # Use GeoDataFrame index as locations
+        color="zone",
+        color_discrete_map=color_dict,  # Adjust color as needed
+        mapbox_style="carto-positron",
+        center={"lat": gdf.geometry.centroid.y.mean(), "lon": gdf.geometry.centroid.x.mean()},
+        zoom=11,
+        opacity=0.3,
+    )
+       
+    # Remove hover labels by setting hovermode to False
+    choropleth_map.update_layout(hovermode=False)
+    return choropleth_map
+
+choropleth_map = get_choropleth_map(dissolved_gdf)
 
 # *****************************************************************************
 # # Show map
 # choropleth_map.show()
 # *****************************************************************************
-  
-# Store parking zones as traces to later on add to other graphs
-traces = []
-for index, row in dissolved_gdf.iterrows():
-    traces.append(choropleth_map.data[index])
+
+# =============================================================================
+# # Level-of-detail pyramid
+# =============================================================================
+# The app shows a coarse version of the zones at city zoom and switches to finer
+# versions when zooming in. shapely.coverage_simplify() simplifies all zones at
+# once and keeps the edges shared by adjacent zones identical, so no gaps or
+# overlaps appear between zones at the coarser levels.
+
+# (minimum map zoom, simplification tolerance in degrees); None = as dissolved
+LOD_LEVELS = [
+    (0, 0.0005),   # city view: ~50 m
+    (13, 0.0001),  # district view: ~10 m
+    (15, None),    # street view: full detail
+]
+
+def simplify_zones(gdf, tolerance):
+    if tolerance is None:
+        return gdf
+    simplified_gdf = gdf.copy()
+    simplified_gdf['geometry'] = shapely.coverage_simplify(np.asarray(gdf.geometry.values), tolerance)
+    return simplified_gdf
+
+# =============================================================================
+# # Save traces as a versioned artifact for the Dash app
+# =============================================================================
+# The Dash app loads this file instead of running GeoPandas and Plotly Express
+# itself. Bump TRACES_FORMAT_VERSION when the structure below changes (the app
+# refuses artifacts of an other format version).
+TRACES_FORMAT_VERSION = 2
+
+def get_traces(choropleth_map):
+    # Plotly Express puts the complete GeoJSON in every trace: only keep the
+    # features that a trace actually draws.
+    figure_dict = json.loads(pio.to_json(choropleth_map))
+    traces = []
+    for trace in figure_dict['data']:
+        locations = {str(location) for location in trace['locations']}
+        trace['geojson'] = {
+            'type': 'FeatureCollection',
+            'features': [feature for feature in trace['geojson']['features'] if str(feature['id']) in locations],
+            }
+        traces.append(trace)
+    return traces
+
+# =============================================================================
+# # Compact coordinate encoding
+# =============================================================================
+# Full precision floats (15+ digits) are far more precise than needed to draw
+# the zones: round coordinates to COORDINATE_DECIMALS decimals (5 decimals is
+# ~1 m) and drop consecutive vertices that became identical by the rounding.
+COORDINATE_DECIMALS = 5
+
+def encode_ring(ring, decimals=COORDINATE_DECIMALS):
+    encoded_ring = []
+    for lon, lat in ring:
+        point = [round(lon, decimals), round(lat, decimals)]
+        if not encoded_ring or point != encoded_ring[-1]:
+            encoded_ring.append(point)
+    # A valid ring needs at least 4 points (first = last)
+    if len(encoded_ring) < 4:
+        return None
+    return encoded_ring
+
+def encode_polygon(polygon, decimals=COORDINATE_DECIMALS):
+    # Drop holes that collapsed; the polygon is dropped if its shell collapsed
+    rings = [encode_ring(ring, decimals) for ring in polygon]
+    if rings[0] is None:
+        return None
+    return [ring for ring in rings if ring is not None]
+
+def encode_geometry(geometry, decimals=COORDINATE_DECIMALS):
+    if geometry['type'] == 'Polygon':
+        polygons = [encode_polygon(geometry['coordinates'], decimals)]
+    else:  # MultiPolygon
+        polygons = [encode_polygon(polygon, decimals) for polygon in geometry['coordinates']]
+    polygons = [polygon for polygon in polygons if polygon is not None]
+    if not polygons:
+        # Everything collapsed by the rounding (a tiny zone at a coarse level
+        # of detail): keep the geometry as it was rather than losing the zone
+        return geometry
+    if geometry['type'] == 'Polygon':
+        return {'type': 'Polygon', 'coordinates': polygons[0]}
+    return {'type': 'MultiPolygon', 'coordinates': polygons}
+
+def encode_traces(traces, decimals=COORDINATE_DECIMALS):
+    for trace in traces:
+        for feature in trace['geojson']['features']:
+            feature['geometry'] = encode_geometry(feature['geometry'], decimals)
+    return traces
+
+# Build, encode and report the size of each level
+levels = []
+for min_zoom, tolerance in LOD_LEVELS:
+    level_traces = get_traces(get_choropleth_map(simplify_zones(dissolved_gdf, tolerance)))
+    size_before = len(json.dumps(level_traces))
+    level_traces = encode_traces(level_traces)
+    size_after = len(json.dumps(level_traces))
+    levels.append({'min_zoom': min_zoom, 'tolerance': tolerance, 'traces': level_traces})
+    print(f"Zoom >= {min_zoom}: {size_before / 1000:.0f} kB -> {size_after / 1000:.0f} kB "
+          f"({1 - size_after / size_before:.0%} smaller)")
+
+# Hash of the source file, to know which data an artifact was built from
+with open('../data/parkeertariefzones-gent.geojson', 'rb') as source_file:
+    source_sha256 = hashlib.sha256(source_file.read()).hexdigest()
+
+traces_artifact = {
+    'format_version': TRACES_FORMAT_VERSION,
+    'source_sha256': source_sha256,
+    'built_at': datetime.now().isoformat(timespec='seconds'),
+    'coordinate_decimals': COORDINATE_DECIMALS,
+    'layout': json.loads(pio.to_json(choropleth_map))['layout'],
+    'levels': levels,
+    }
 
 # Save traces to file
 traces_filename = '../data/parking_zones_ghent-traces.json'
-traces_data = [pio.to_json(trace) for trace in traces]
 with open(traces_filename, 'w') as traces_file:
-    json.dump(traces_data, traces_file)
\ No newline at end of file
+    json.dump(traces_artifact, traces_file)
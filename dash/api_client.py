@@ -0,0 +1,125 @@
+"""
+HTTP client for the Stad Gent open data API.
+
+- one requests.Session per process, so keep-alive connections are reused
+  between polls, but never shared with a forked process (a gunicorn worker
+  forked from the preloaded master would use the same sockets as the others)
+- connect and read timeouts, so a hanging upstream never blocks forever
+- retries with jittered exponential backoff on connection errors, timeouts,
+  429 and 5xx responses (waiting as long as a Retry-After header asks, up to
+  max_retry_after seconds; a longer wait is not retried)
+- conditional requests: the ETag / Last-Modified of the last response are sent
+  back as If-None-Match / If-Modified-Since, and a 304 Not Modified response
+  is reported as NOT_MODIFIED (no payload is downloaded again)
+"""
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import UPSTREAM_BYTES
+
+# Returned by get_json() when the server answered 304 Not Modified
+NOT_MODIFIED = object()
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def retry_after_seconds(response):
+    """Seconds to wait according to the Retry-After header (seconds or an
+    HTTP date), or None without a valid header."""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class ApiClient:
+    def __init__(self, connect_timeout=3.05, read_timeout=10, retries=3,
+                 backoff=0.5, max_backoff=8, max_retry_after=30, pool_size=4):
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.pool_size = pool_size
+        self._session = None
+        self._session_pid = None
+        self._validators = {}  # (url, params) -> headers for a conditional request
+
+    @property
+    def session(self):
+        """The requests.Session of this process, created on first use (and
+        again after a fork)."""
+        if self._session is None or self._session_pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers['User-Agent'] = 'parkeergarages-gent (https://github.com/NT131/parkeergarages_gent)'
+            # The session of the parent is not closed: that would close the
+            # sockets the parent still uses
+            self._session, self._session_pid = session, os.getpid()
+        return self._session
+
+    def _sleep_before_retry(self, attempt, retry_after=None):
+        # "Full jitter": random wait up to the exponential backoff, but at
+        # least as long as the server asked
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        time.sleep(max(delay, retry_after or 0))
+
+    def get(self, url, params=None, conditional=True, stream=False):
+        """GET 'url', retrying on transient errors. Returns the last response
+        (which can be a 304 for a conditional request), or raises the last
+        requests exception if no response was received at all. With 'stream',
+        the body is only downloaded while it is read."""
+        key = (url, tuple(sorted((params or {}).items())))
+        headers = dict(self._validators.get(key, {})) if conditional else {}
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            try:
+                response = self.session.get(url, params=params, headers=headers,
+                                            timeout=self.timeout, stream=stream)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or attempt == self.retries:
+                    break
+                retry_after = retry_after_seconds(response)
+                if retry_after is not None and retry_after > self.max_retry_after:
+                    break  # not worth waiting for: the next poll tries again
+                # Release the connection to the pool (not done by requests for
+                # a streamed response that is never read)
+                response.close()
+            self._sleep_before_retry(attempt, retry_after)
+
+        if response.status_code == 200:
+            if not stream:
+                UPSTREAM_BYTES.inc(len(response.content))
+            validators = {}
+            if response.headers.get('ETag'):
+                validators['If-None-Match'] = response.headers['ETag']
+            if response.headers.get('Last-Modified'):
+                validators['If-Modified-Since'] = response.headers['Last-Modified']
+            self._validators[key] = validators
+        return response
+
+    def get_json(self, url, params=None, conditional=True):
+        """Parsed JSON of 'url'; NOT_MODIFIED for a 304 response. Raises
+        requests.HTTPError for other non-200 responses."""
+        response = self.get(url, params, conditional)
+        if response.status_code == 304:
+            return NOT_MODIFIED
+        response.raise_for_status()
+        return response.json()
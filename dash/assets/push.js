@@ -0,0 +1,21 @@
+/* push.js: listen for new snapshots (Server-Sent Events, see push.py) and let
+   the Dash callback fetch the update by clicking the hidden 'push-trigger'. */
+(function () {
+    if (!window.EventSource) {
+        return;
+    }
+    var config = JSON.parse(document.getElementById('_dash-config').textContent);
+    var lastVersion = null;
+    var source = new EventSource(config.requests_pathname_prefix + 'events');
+    source.onmessage = function (event) {
+        if (event.data === lastVersion) {
+            return;
+        }
+        var trigger = document.getElementById('push-trigger');
+        // The first message only tells which version the page already shows
+        if (trigger && lastVersion !== null) {
+            trigger.click();
+        }
+        lastVersion = event.data;
+    };
+})();
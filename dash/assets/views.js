@@ -0,0 +1,16 @@
+/* views.js: switch between the views of the map without a server roundtrip.
+   The figure contains the traces of all views; the traces to show per display
+   option are in figure.layout.meta.views (see VIEWS in the app). */
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    parkings: {
+        show_view: function (display_option, figure) {
+            var views = figure.layout.meta.views;
+            var view = views[display_option] || views['parkings'];
+            var data = figure.data.map(function (trace) {
+                return Object.assign({}, trace, {visible: view.traces.indexOf(trace.meta) !== -1});
+            });
+            var layout = Object.assign({}, figure.layout, {hovermode: view.hovermode});
+            return Object.assign({}, figure, {data: data, layout: layout});
+        }
+    }
+});
@@ -0,0 +1,215 @@
+"""
+Benchmarks of the request path and the ingestion path.
+
+    python3 benchmarks.py [--repeat 30] [--only callback] [--output results.json]
+                          [--compare previous_results.json]
+
+Covered: loading the snapshot (JSON parse, garage table and DataFrame), the
+figure builds (parkings and all views), serializing a figure, the
+update_data callback through Dash's test client (full figure, patch and
+unchanged), and fetch_data() against the local replay of the Stad Gent API
+(see replay_api.py).
+
+Runs on a temporary copy of the data folder (PARKINGS_DATA_DIR), so the real
+snapshots and history are never touched. The results are written as JSON
+(timings in milliseconds, with the commit they were measured on); --compare
+shows the change of the median against an earlier result file.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+DASH_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DATA_DIR = os.path.join(DASH_DIR, '..', 'data')
+
+# Files of the data folder the app needs (not the history, locks, ...)
+DATA_FILES = ['fetched_data.json', 'last_update.txt', 'parking_zones_ghent-traces.json']
+
+# =============================================================================
+# Timing
+# =============================================================================
+
+def measure(function, repeat, setup=None, warmup=2):
+    """Call 'function' 'warmup' + 'repeat' times ('setup' before each call,
+    not timed). Returns statistics of the timed calls in milliseconds."""
+    timings = []
+    for iteration in range(warmup + repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        elapsed = (time.perf_counter() - start) * 1000
+        if iteration >= warmup:
+            timings.append(elapsed)
+    timings.sort()
+    return {
+        'unit': 'ms',
+        'repeat': repeat,
+        'min': round(timings[0], 4),
+        'median': round(statistics.median(timings), 4),
+        'mean': round(statistics.fmean(timings), 4),
+        'p95': round(timings[min(len(timings) - 1, int(0.95 * len(timings)))], 4),
+        'stdev': round(statistics.stdev(timings), 4) if len(timings) > 1 else 0.0,
+    }
+
+# =============================================================================
+# Benchmarks
+# =============================================================================
+
+def callback_body(figure_state, display_option='parkings', zones_level=0):
+    """Request of the browser for the update_data callback, as sent after a
+    server push."""
+    outputs = [('live-update-graph', 'figure'), ('last-update-time', 'children'),
+               ('zones-level', 'data'), ('figure-state', 'data')]
+    return {
+        'output': '..' + '...'.join(f"{component}.{prop}" for component, prop in outputs) + '..',
+        'outputs': [{'id': component, 'property': prop} for component, prop in outputs],
+        'inputs': [
+            {'id': 'push-trigger', 'property': 'n_clicks', 'value': 1},
+            {'id': 'refresh-btn', 'property': 'n_clicks', 'value': None},
+            {'id': 'live-update-graph', 'property': 'relayoutData', 'value': None},
+        ],
+        'state': [
+            {'id': 'display-option', 'property': 'value', 'value': display_option},
+            {'id': 'zones-level', 'property': 'data', 'value': zones_level},
+            {'id': 'figure-state', 'property': 'data', 'value': figure_state},
+        ],
+        'changedPropIds': ['push-trigger.n_clicks'],
+    }
+
+
+def run_benchmarks(repeat, only=None):
+    # Imported here: the data folder must be set before the app modules load
+    import plotly.io as pio
+    from plotly.utils import PlotlyJSONEncoder
+
+    import ingest
+    import parkings_ghent_app_dash as app_module
+    from figure_cache import figure_cache
+    from garages import garage_table
+    from replay_api import ReplayApi, ReplayData
+    from snapshot_cache import SnapshotCache, snapshot_cache
+    from snapshot_store import DATA_FILE
+
+    with open(DATA_FILE, 'r') as data_file:
+        records = json.load(data_file)
+    snapshot = snapshot_cache.get()
+    df = snapshot['df']
+    figure = app_module.get_figure(snapshot)
+    client = app_module.app.server.test_client()
+    url = app_module.app.config.requests_pathname_prefix + '_dash-update-component'
+    figure_state = app_module.get_figure_state(snapshot)
+    replay_data = ReplayData([records], snapshot_interval=0, drift_interval=0)
+    replay = ReplayApi(replay_data).start()
+    ingest.ods_client.base_url = replay.base_url
+
+    def load_json():
+        with open(DATA_FILE, 'r') as data_file:
+            json.load(data_file)
+
+    def post_callback(state):
+        response = client.post(url, json=callback_body(state))
+        assert response.status_code in (200, 204), response.status_code
+
+    def set_drift(drift):
+        # Without drift the replay answers 304 (conditional request); with
+        # drift every fetch publishes a new snapshot
+        replay_data.drift = 0.02 if drift else 0.0
+
+    benchmarks = {
+        # Snapshot loading
+        'json_load': (load_json, None),
+        'garage_table': (lambda: garage_table(records).to_frame(), None),
+        'snapshot_load': (lambda: SnapshotCache().get(), None),
+        # Figure builds and serialization
+        'update_parkings': (lambda: app_module.update_parkings(df), None),
+        'build_figure': (lambda: app_module.build_figure(df), None),
+        'serialize_figure': (lambda: pio.to_json(app_module.build_figure(df), validate=False), None),
+        'serialize_response': (lambda: json.dumps(figure, cls=PlotlyJSONEncoder), None),
+        # update_data callback through the test client
+        'callback_full_cold': (lambda: post_callback(None), figure_cache.clear),
+        'callback_full': (lambda: post_callback(None), None),
+        'callback_patch': (lambda: post_callback(dict(figure_state, version=-1)), None),
+        'callback_unchanged': (lambda: post_callback(figure_state), None),
+        # Ingestion against the replay API
+        'fetch_unchanged': (ingest.fetch_data, lambda: set_drift(False)),
+        'fetch_changed': (ingest.fetch_data, lambda: set_drift(True)),
+    }
+    results = {}
+    try:
+        for name, (function, setup) in benchmarks.items():
+            if only and not any(part in name for part in only):
+                continue
+            results[name] = measure(function, repeat, setup)
+            print(f"{name:<24} median {results[name]['median']:10.3f} ms   "
+                  f"p95 {results[name]['p95']:10.3f} ms", file=sys.stderr)
+    finally:
+        replay.close()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=DASH_DIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous):
+    print(f"\n{'benchmark':<24} {'before (ms)':>12} {'after (ms)':>12} {'change':>8}")
+    for name, result in results['benchmarks'].items():
+        before = previous['benchmarks'].get(name)
+        if before is None:
+            continue
+        change = (result['median'] - before['median']) / before['median'] * 100 if before['median'] else 0
+        print(f"{name:<24} {before['median']:12.3f} {result['median']:12.3f} {change:+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--only', nargs='*', help="only the benchmarks of which the name contains one of these")
+    parser.add_argument('--output', help="JSON file for the results (default: standard output)")
+    parser.add_argument('--compare', help="JSON results of an earlier run")
+    arguments = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='parkings-benchmark-')
+    for name in DATA_FILES:
+        shutil.copy(os.path.join(SOURCE_DATA_DIR, name), data_dir)
+    os.environ['PARKINGS_DATA_DIR'] = data_dir
+    os.environ['PARKINGS_INGEST_MODE'] = 'sidecar'  # no poller: the benchmarks fetch
+    sys.path.insert(0, DASH_DIR)
+    try:
+        results = {
+            'meta': {
+                'commit': git_commit(),
+                'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+            },
+            'benchmarks': run_benchmarks(arguments.repeat, arguments.only),
+        }
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    if arguments.output:
+        with open(arguments.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    if arguments.compare:
+        with open(arguments.compare, 'r') as previous_file:
+            compare(results, json.load(previous_file))
+
+
+if __name__ == '__main__':
+    main()
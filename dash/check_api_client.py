@@ -0,0 +1,128 @@
+"""
+Checks of the API client (api_client.py) against a local stub server:
+
+    python3 check_api_client.py
+
+The stub answers each request with the next scripted response, so every check
+states exactly what the upstream does: 304 handling of conditional requests,
+retries after 503 and 429 (with Retry-After), and timeouts on a hanging
+response. Exits with an error at the first failed check.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from api_client import NOT_MODIFIED, ApiClient
+
+# =============================================================================
+# Stub server
+# =============================================================================
+
+class StubServer:
+    """Answers the n-th request with the n-th scripted response: a dict with
+    'status', 'headers', 'body' and 'delay' (seconds before answering). The
+    request headers are kept in 'requests'."""
+    def __init__(self):
+        self.script = []
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                stub.requests.append(dict(self.headers))
+                response = stub.script.pop(0) if stub.script else {'status': 500}
+                time.sleep(response.get('delay', 0))
+                body = json.dumps(response.get('body', {})).encode('utf-8') if response['status'] != 304 else b''
+                self.send_response(response['status'])
+                for name, value in response.get('headers', {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/records"
+
+    def reset(self, *script):
+        self.script = list(script)
+        self.requests = []
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+# =============================================================================
+# Checks
+# =============================================================================
+
+def check_not_modified(stub):
+    client = ApiClient(backoff=0)
+    stub.reset({'status': 200, 'headers': {'ETag': '"v1"', 'Last-Modified': 'Tue, 23 Jan 2024 14:14:00 GMT'},
+                'body': {'results': [1]}},
+               {'status': 304})
+    assert client.get_json(stub.url) == {'results': [1]}
+    assert client.get_json(stub.url) is NOT_MODIFIED
+    assert stub.requests[1].get('If-None-Match') == '"v1"', stub.requests[1]
+    assert stub.requests[1].get('If-Modified-Since') == 'Tue, 23 Jan 2024 14:14:00 GMT'
+
+
+def check_retry_on_503(stub):
+    client = ApiClient(retries=3, backoff=0)
+    stub.reset({'status': 503}, {'status': 503}, {'status': 200, 'body': {'results': [2]}})
+    assert client.get_json(stub.url) == {'results': [2]}
+    assert len(stub.requests) == 3, len(stub.requests)
+    # With stream=True the failed responses are closed before retrying
+    stub.reset({'status': 503}, {'status': 200})
+    assert client.get(stub.url, stream=True).status_code == 200
+
+
+def check_retry_after(stub):
+    client = ApiClient(retries=1, backoff=0, max_retry_after=5)
+    stub.reset({'status': 429, 'headers': {'Retry-After': '1'}}, {'status': 200, 'body': {}})
+    start = time.perf_counter()
+    assert client.get(stub.url).status_code == 200
+    assert time.perf_counter() - start >= 1, "Retry-After was not respected"
+    # Longer than max_retry_after: not retried, the 429 is returned
+    stub.reset({'status': 429, 'headers': {'Retry-After': '600'}}, {'status': 200})
+    assert client.get(stub.url).status_code == 429
+    assert len(stub.requests) == 1
+
+
+def check_timeout(stub):
+    client = ApiClient(read_timeout=0.2, retries=1, backoff=0)
+    stub.reset({'status': 200, 'delay': 1}, {'status': 200, 'delay': 1})
+    start = time.perf_counter()
+    try:
+        client.get(stub.url)
+    except requests.Timeout:
+        pass
+    else:
+        raise AssertionError("no requests.Timeout on a hanging response")
+    assert time.perf_counter() - start < 1.5, "the timeout did not bound the wait"
+
+
+CHECKS = [check_not_modified, check_retry_on_503, check_retry_after, check_timeout]
+
+
+def main():
+    stub = StubServer()
+    try:
+        for check in CHECKS:
+            check(stub)
+            print(f"{check.__name__}: ok")
+    finally:
+        stub.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Checks of the Opendatasoft client (opendatasoft.py) against the local replay
+of the Stad Gent API (replay_api.py):
+
+    python3 check_opendatasoft.py
+
+The replay serves 250 garages (the recorded snapshot, repeated with other ids
+and names), so the records endpoint needs several pages. Checked: pagination
+across pages, 'select' / 'where' / 'order_by', the 304 on the first page of a
+conditional request (only trusted when the result fits in one page), and the
+streaming of the jsonl and geojson exports. Exits with an error at the first
+failed check.
+"""
+import json
+import os
+import tempfile
+
+from api_client import NOT_MODIFIED
+from ingest import DATASET
+from opendatasoft import MAX_PAGE_SIZE, OpendatasoftClient
+from replay_api import ZONES_DATASET, ReplayApi, ReplayData
+from snapshot_store import DATA_FILE
+
+GARAGES = 250
+
+# =============================================================================
+# Replayed data
+# =============================================================================
+
+def many_garages(count=GARAGES):
+    """'count' garages, based on the recorded snapshot."""
+    with open(DATA_FILE, 'r') as data_file:
+        recorded = json.load(data_file)
+    records = []
+    for index in range(count):
+        record = dict(recorded[index % len(recorded)])
+        record['id'] = f"garage-{index:04d}"
+        record['name'] = f"Garage {index:04d}"
+        records.append(record)
+    return records
+
+# =============================================================================
+# Checks
+# =============================================================================
+
+def check_pagination(client, replay):
+    records = client.list_records(DATASET, order_by='id')
+    assert len(records) == GARAGES, len(records)
+    assert [record['id'] for record in records] == [f"garage-{index:04d}" for index in range(GARAGES)]
+    # iter_records with a smaller page and a limit that is not a multiple of it
+    requests_before = replay.requests
+    records = list(client.iter_records(DATASET, order_by='id', page_size=30, limit=95))
+    assert [record['id'] for record in records] == [f"garage-{index:04d}" for index in range(95)]
+    assert replay.requests - requests_before == 4, replay.requests - requests_before
+
+
+def check_query(client, replay):
+    records = client.list_records(DATASET, select=['name', 'id'], where='name != "Garage 0007"')
+    assert len(records) == GARAGES - 1
+    assert all(set(record) == {'name', 'id'} for record in records), records[0]
+    assert 'Garage 0007' not in {record['name'] for record in records}
+    records = client.list_records(DATASET, select='id', where='id = "garage-0042"')
+    assert records == [{'id': 'garage-0042'}], records
+
+
+def check_not_modified(client, replay):
+    # More than one page: a 304 on the first page says nothing about the
+    # others, so the records are fetched again
+    assert len(client.list_records(DATASET, conditional=True)) == GARAGES
+    requests_before = replay.requests
+    records = client.list_records(DATASET, conditional=True)
+    assert records is not NOT_MODIFIED and len(records) == GARAGES
+    assert replay.requests - requests_before == 1 + -(-GARAGES // MAX_PAGE_SIZE)
+    # One page: the 304 is trusted, nothing else is requested
+    where = 'name != "Garage 0000"'
+    small = ReplayData([many_garages(MAX_PAGE_SIZE)], snapshot_interval=0)
+    replay.data, data = small, replay.data
+    try:
+        assert len(client.list_records(DATASET, where=where, conditional=True)) == MAX_PAGE_SIZE - 1
+        requests_before = replay.requests
+        assert client.list_records(DATASET, where=where, conditional=True) is NOT_MODIFIED
+        assert replay.requests - requests_before == 1
+        # Changed data: a 200 with the new records
+        small.drift, small.drift_interval = 0.05, 0
+        assert len(client.list_records(DATASET, where=where, conditional=True)) == MAX_PAGE_SIZE - 1
+    finally:
+        replay.data = data
+
+
+def check_exports(client, replay):
+    records = list(client.iter_export(DATASET, select=['id'], where='id != "garage-0001"', order_by='id'))
+    assert len(records) == GARAGES - 1 and records[0] == {'id': 'garage-0000'}, records[:2]
+    with tempfile.TemporaryDirectory() as directory:
+        path = client.download_export(ZONES_DATASET, 'geojson', os.path.join(directory, 'zones.geojson'))
+        with open(path, 'r') as zones_file:
+            zones = json.load(zones_file)
+    assert zones['type'] == 'FeatureCollection' and zones['features']
+
+
+CHECKS = [check_pagination, check_query, check_not_modified, check_exports]
+
+
+def main():
+    replay = ReplayApi(ReplayData([many_garages()], snapshot_interval=0)).start()
+    try:
+        client = OpendatasoftClient(replay.base_url)
+        for check in CHECKS:
+            check(client, replay)
+            print(f"{check.__name__}: ok")
+    finally:
+        replay.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Cache of the map figures, shared by all sessions of a worker.
+
+One figure holds the traces of all views (see VIEWS in the app). It only
+depends on the snapshot version and a variant: the level of detail of the
+zones and the version of the forecast profiles. So each variant is built
+(with Plotly Express) and serialized once per snapshot version. Callbacks
+return the cached, JSON-ready dict, which Dash can send without validating or
+converting a plotly Figure again.
+"""
+import json
+import threading
+from collections import OrderedDict
+
+import plotly.io as pio
+
+from metrics import CACHE_REQUESTS
+
+
+class FigureCache:
+    def __init__(self, max_entries=12):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._figures = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, version, variant, build):
+        """Return the serialized figure for (version, variant), where the
+        variant is (zones_level, profiles_version). On a miss 'build()' is
+        called to create the plotly Figure."""
+        key = (version, variant)
+        with self._lock:
+            figure = self._figures.get(key)
+            if figure is not None:
+                self._figures.move_to_end(key)
+                self.hits += 1
+                CACHE_REQUESTS.labels('figure', 'hit').inc()
+                return figure
+        # Build outside the lock: other views can be served in the meantime
+        figure = json.loads(pio.to_json(build(), validate=False))
+        with self._lock:
+            self.misses += 1
+            CACHE_REQUESTS.labels('figure', 'miss').inc()
+            self._figures[key] = figure
+            self._evict(version)
+        return figure
+
+    def _evict(self, version):
+        # Figures of older snapshots will not be requested again
+        for key in [key for key in self._figures if key[0] < version]:
+            del self._figures[key]
+        # Bound the size (least recently used first)
+        while len(self._figures) > self.max_entries:
+            self._figures.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._figures.clear()
+
+
+# Cache shared by all callbacks of this worker
+figure_cache = FigureCache()
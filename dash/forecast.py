@@ -0,0 +1,182 @@
+"""
+Forecast of the available capacity per garage.
+
+The upstream 'occupancytrend' field is always "unknown", so we make our own
+forecast from the occupancy history. For every garage a seasonal profile of
+the available capacity is learned: the mean per weekday and per half hour of
+the day (local time). The forecast for the next hours is the profile value at
+that time, corrected with the current deviation from the profile, which fades
+out over a few hours.
+
+Fitting reads weeks of history and runs offline or in the poller (see
+fit_profiles_if_outdated()); the web workers only load the fitted profiles, so
+serving a forecast is an array lookup.
+
+    python3 forecast.py --fit
+"""
+import io
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from history_store import HISTORY_DIR, history_store
+from snapshot_store import atomic_write
+
+# =============================================================================
+# Settings
+# =============================================================================
+PROFILES_FILE = os.path.join(HISTORY_DIR, 'forecast_profiles.npz')
+
+TIMEZONE = 'Europe/Brussels'
+SLOT_MINUTES = 30
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+
+# History used to fit the profiles, and how often the poller refits them
+FIT_WEEKS = 8
+FIT_INTERVAL = 6 * 60 * 60
+
+# Hours after which the current deviation from the profile has faded to 1/e
+DEVIATION_DECAY_HOURS = 2
+
+# Forecast horizons shown in the app (hours)
+HORIZONS = (1, 2, 3)
+
+# =============================================================================
+# Fitting
+# =============================================================================
+
+def weekday_and_slot(timestamps):
+    """Weekday (0 = Monday) and slot of the day, in local time, of an array of
+    timestamps (seconds since epoch)."""
+    local = pd.DatetimeIndex(pd.to_datetime(np.asarray(timestamps), unit='s', utc=True)).tz_convert(TIMEZONE)
+    slots = (local.hour * 60 + local.minute) // SLOT_MINUTES
+    return np.asarray(local.weekday), np.asarray(slots)
+
+
+def fit_profiles(history=history_store, now=None, weeks=FIT_WEEKS):
+    """Learn the profiles from the history of the last 'weeks' weeks. Returns
+    an array [garage code, weekday, slot] of the mean available capacity (NaN
+    where no garage data at all is available)."""
+    now = now or time.time()
+    rows = history.scan(now - weeks * 7 * 24 * 60 * 60, now, columns=['timestamp', 'garage', 'availablecapacity'])
+    n_garages = len(history.garages())
+    shape = (n_garages, 7, SLOTS_PER_DAY)
+    if n_garages == 0:
+        return np.full(shape, np.nan, dtype=np.float32)
+
+    # Sum and count per (garage, weekday, slot) cell in one pass
+    weekdays, slots = weekday_and_slot(rows['timestamp'])
+    cells = np.ravel_multi_index((rows['garage'].astype(np.int64), weekdays, slots), shape)
+    size = n_garages * 7 * SLOTS_PER_DAY
+    sums = np.bincount(cells, weights=rows['availablecapacity'], minlength=size).reshape(shape)
+    counts = np.bincount(cells, minlength=size).reshape(shape)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        profiles = sums / counts
+        # Cells without data: mean of that slot over all weekdays, and else
+        # the overall mean of the garage
+        slot_means = sums.sum(axis=1) / counts.sum(axis=1)
+        garage_means = sums.sum(axis=(1, 2)) / counts.sum(axis=(1, 2))
+    profiles = np.where(counts > 0, profiles, slot_means[:, None, :])
+    profiles = np.where(np.isnan(profiles), garage_means[:, None, None], profiles)
+    return profiles.astype(np.float32)
+
+
+def save_profiles(profiles, path=PROFILES_FILE):
+    buffer = io.BytesIO()
+    np.savez(buffer, profiles=profiles, fitted_at=np.float64(time.time()))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    atomic_write(path, buffer.getvalue())
+
+
+def fit_profiles_if_outdated(history=history_store, path=PROFILES_FILE):
+    """Refit the profiles when they are older than FIT_INTERVAL (called by the
+    poller after each snapshot)."""
+    try:
+        age = time.time() - os.path.getmtime(path)
+    except OSError:
+        age = None
+    if age is None or age > FIT_INTERVAL:
+        save_profiles(fit_profiles(history), path)
+        return True
+    return False
+
+# =============================================================================
+# Serving
+# =============================================================================
+
+class ProfileCache:
+    """Fitted profiles of this worker, reloaded when the file changes."""
+    def __init__(self, path=PROFILES_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._profiles = None
+
+    def get(self):
+        """Return (version, profiles); (None, None) if not fitted yet."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None, None
+        if mtime != self._mtime:
+            with self._lock:
+                with np.load(self.path) as fitted:
+                    self._profiles = fitted['profiles']
+                self._mtime = mtime
+        return self._mtime, self._profiles
+
+
+profile_cache = ProfileCache()
+
+
+def snapshot_time(df):
+    """Time of a snapshot: its latest 'lastupdate' (seconds since epoch), or
+    the current time if the snapshot has none."""
+    lastupdate = df['lastupdate'].max() if 'lastupdate' in df and len(df) else 0
+    return float(lastupdate) if lastupdate and lastupdate > 0 else datetime.now().timestamp()
+
+
+def forecast_available(df, horizons=HORIZONS, now=None, history=history_store):
+    """Expected available capacity of the garages in 'df' (a snapshot) after
+    each of the horizons (hours), as an array [garage row, horizon]. Garages
+    without a profile keep their current value.
+
+    The horizons count from 'now', by default the time of the snapshot itself
+    (its latest 'lastupdate'): the figure is cached per snapshot version, so
+    the forecast must not depend on when (or in which worker) it is built."""
+    _, profiles = profile_cache.get()
+    current = df['availablecapacity'].to_numpy(dtype=float)
+    forecast = np.repeat(current[:, None], len(horizons), axis=1)
+    if profiles is None:
+        return forecast
+
+    codes = np.array([history.garage_code(garage_id) for garage_id in df.get('id', df['name'])], dtype=object)
+    known = np.array([code is not None and code < len(profiles) for code in codes])
+    if not known.any():
+        return forecast
+    known_codes = codes[known].astype(np.int64)
+
+    now = now or snapshot_time(df)
+    hours = np.asarray(horizons, dtype=float)
+    weekdays, slots = weekday_and_slot([now] + list(now + hours * 60 * 60))
+    profile_now = profiles[known_codes, weekdays[0], slots[0]]
+    profile_future = profiles[known_codes[:, None], weekdays[None, 1:], slots[None, 1:]]
+
+    # Current deviation from the profile, fading out with the horizon
+    deviation = current[known] - profile_now
+    expected = profile_future + deviation[:, None] * np.exp(-hours / DEVIATION_DECAY_HOURS)[None, :]
+    expected = np.where(np.isnan(expected), current[known][:, None], expected)
+    total = df['totalcapacity'].to_numpy(dtype=float)[known]
+    forecast[known] = np.clip(np.round(expected), 0, total[:, None])
+    return forecast
+
+
+if __name__ == '__main__':
+    if '--fit' in sys.argv:
+        save_profiles(fit_profiles())
@@ -0,0 +1,146 @@
+"""
+Compact model of the parking garages.
+
+The upstream records repeat the static attributes of a garage (id, name,
+location, capacity) in every snapshot. They are kept once per worker in the
+garage registry, which gives every garage a code (its row). A snapshot is then
+only a NumPy structured array of the dynamic fields, indexed by that code, so
+everything computed from it is vectorized:
+
+    table = garage_table(records)
+    table.state['availablecapacity']    # per code, see table.present
+    table.to_frame()                    # DataFrame for the figures
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+from history_store import parse_lastupdate
+
+# =============================================================================
+# Settings
+# =============================================================================
+
+# Static attributes of a garage (id and name are kept as Python strings)
+STATIC_DTYPE = np.dtype([
+    ('lat', '<f8'),
+    ('lon', '<f8'),
+    ('totalcapacity', '<i4'),
+])
+
+# Fields of a garage that change with every snapshot
+STATE_DTYPE = np.dtype([
+    ('present', '?'),              # garage is part of the snapshot
+    ('availablecapacity', '<i4'),
+    ('occupation', '<i2'),         # percentage
+    ('isopennow', '<i1'),
+    ('temporaryclosed', '<i1'),
+    ('lastupdate', '<i8'),         # seconds since epoch
+])
+
+# =============================================================================
+# Garage registry
+# =============================================================================
+
+class GarageRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._codes = {}   # garage id -> code
+        self.ids = []
+        self.names = []
+        self.static = np.empty(0, dtype=STATIC_DTYPE)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def code(self, garage_id):
+        """Code of a garage (None if unknown)."""
+        return self._codes.get(garage_id)
+
+    def register(self, records):
+        """Codes of the garages of 'records', adding new garages to the
+        registry (in order of garage id, not in the row order of the upstream
+        response). Static attributes that changed upstream (e.g. the capacity
+        after a renovation) are updated."""
+        with self._lock:
+            codes = np.empty(len(records), dtype=np.int64)
+            new_static = []
+            garage_ids = [record.get('id') or record['name'] for record in records]
+            for index in sorted(range(len(records)), key=lambda index: str(garage_ids[index])):
+                record = records[index]
+                garage_id = garage_ids[index]
+                code = self._codes.get(garage_id)
+                if code is None:
+                    code = self._codes[garage_id] = len(self.ids)
+                    self.ids.append(garage_id)
+                    self.names.append(record['name'])
+                    new_static.append(None)
+                location = record.get('location') or {}
+                static = (location.get('lat', np.nan), location.get('lon', np.nan),
+                          record.get('totalcapacity') or 0)
+                if code >= len(self.static):
+                    new_static[code - len(self.static)] = static
+                else:
+                    self.static[code] = static
+                    self.names[code] = record['name']
+                codes[index] = code
+            if new_static:
+                new_static = np.array(new_static, dtype=STATIC_DTYPE)
+                self.static = np.concatenate([self.static, new_static])
+            return codes
+
+
+# Garages seen by this worker
+garage_registry = GarageRegistry()
+
+# =============================================================================
+# Garages of one snapshot
+# =============================================================================
+
+class GarageTable:
+    def __init__(self, registry, state):
+        self.registry = registry
+        self.state = state                  # STATE_DTYPE, indexed by code
+        # Codes of the garages in the snapshot, in order of garage id: the
+        # codes depend on the snapshots a worker saw first, this order does not
+        present = np.flatnonzero(state['present'])
+        ids = np.array(registry.ids, dtype=object)[present]
+        self.present = present[np.argsort(ids.astype(str), kind='stable')]
+
+    def __len__(self):
+        return len(self.present)
+
+    def to_frame(self):
+        """DataFrame of the garages in the snapshot (one row per garage, in
+        order of garage id) with the columns used by the figures and the
+        forecast."""
+        state = self.state[self.present]
+        static = self.registry.static[self.present]
+        return pd.DataFrame({
+            'id': np.array(self.registry.ids, dtype=object)[self.present],
+            'name': np.array(self.registry.names, dtype=object)[self.present],
+            'lat': static['lat'],
+            'lon': static['lon'],
+            'totalcapacity': static['totalcapacity'],
+            'availablecapacity': state['availablecapacity'],
+            'occupation': state['occupation'],
+            'isopennow': state['isopennow'],
+            'temporaryclosed': state['temporaryclosed'],
+            'lastupdate': state['lastupdate'],
+        })
+
+
+def garage_table(records, registry=garage_registry):
+    """Compact table of the garages in a snapshot."""
+    codes = registry.register(records)
+    state = np.zeros(len(registry), dtype=STATE_DTYPE)
+    state[codes] = np.array([
+        (True,
+         record.get('availablecapacity') or 0,
+         record.get('occupation') or 0,
+         record.get('isopennow') or 0,
+         record.get('temporaryclosed') or 0,
+         parse_lastupdate(record['lastupdate']) if record.get('lastupdate') else 0)
+        for record in records], dtype=STATE_DTYPE)
+    return GarageTable(registry, state)
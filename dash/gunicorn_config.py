@@ -0,0 +1,51 @@
+"""
+Gunicorn settings of the app (see gunicorn_parkings_ghent.service):
+
+    gunicorn -c gunicorn_config.py parkings_ghent_app_dash:application
+
+The app is imported once in the master (preload_app): Dash, Plotly, pandas and
+the zone traces are loaded a single time and shared copy-on-write by all
+workers, so a (re)started worker is ready in milliseconds instead of
+re-importing everything. The background threads are started in each worker
+after the fork.
+
+The Prometheus metrics of all workers are aggregated through files in
+METRICS_DIR (see metrics.py).
+"""
+import os
+import shutil
+
+preload_app = True
+
+bind = '0.0.0.0:5001'
+workers = 7
+worker_class = 'gevent'
+worker_connections = 1000
+
+# The gevent worker monkey-patches the standard library in each worker, after
+# the fork; with preload_app the app modules (requests, threading, ...) were
+# imported before that, so patch in the master before the app is loaded.
+if worker_class == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+from snapshot_store import DATA_DIR
+
+# Must be set before prometheus_client is imported (by the app)
+METRICS_DIR = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(DATA_DIR, 'metrics'))
+
+# Metrics of a previous run do not belong to this one. Done here, as the app
+# (which creates the metric files) is preloaded before gunicorn's first hook.
+shutil.rmtree(METRICS_DIR, ignore_errors=True)
+os.makedirs(METRICS_DIR)
+
+
+def post_worker_init(worker):
+    # Import of the preloaded module: no cost
+    from parkings_ghent_app_dash import start_background_threads
+    start_background_threads()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
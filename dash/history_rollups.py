@@ -0,0 +1,220 @@
+"""
+Rollups (5 minutes / hourly / daily) of the occupancy history.
+
+For every garage and time bucket the number of samples and the min, max and
+sum of the occupation are kept, so the mean can be derived. The rollups are
+updated incrementally with the rows appended to the history: only the buckets
+of those rows change. Each poll rewrites the partition files of the new rows,
+one per resolution: a day of 5 minute or hourly buckets, a month of daily
+buckets (a few thousand rows at most, so rewriting a whole file is cheaper
+than appending to it). A chart of a month of data per garage thus never reads
+the raw snapshots.
+
+Buckets and partitions follow the local time of Ghent (Europe/Brussels): a
+daily bucket runs from midnight to midnight, also across DST changes.
+
+Layout (in '../data/history/rollups', partitions named in local time):
+    5min/2024-01-23.npy
+    hour/2024-01-23.npy
+    day/2024-01.npy
+
+The rollups are rebuilt from the history automatically when their format
+changed (FORMAT_VERSION), or with:
+
+    python3 history_rollups.py --rebuild
+"""
+import io
+import json
+import os
+import sys
+import threading
+import numpy as np
+import pandas as pd
+
+from history_store import HISTORY_DIR, history_store
+from snapshot_store import atomic_write
+
+# =============================================================================
+# Settings
+# =============================================================================
+ROLLUPS_DIR = os.path.join(HISTORY_DIR, 'rollups')
+# Version of the layout of the rollups: bump when the buckets or partitions
+# change, the rollups are then rebuilt
+FORMAT_VERSION = 2
+
+TIMEZONE = 'Europe/Brussels'
+DAY = 24 * 60 * 60
+
+# Name -> (bucket size in seconds, partition of the rollup files), fine to coarse
+RESOLUTIONS = {
+    '5min': (5 * 60, '%Y-%m-%d'),
+    'hour': (60 * 60, '%Y-%m-%d'),
+    'day': (DAY, '%Y-%m'),
+}
+
+ROLLUP_DTYPE = np.dtype([
+    ('garage', '<u2'),
+    ('bucket', '<i8'),   # start of the bucket, seconds since epoch (local time aligned)
+    ('count', '<i4'),
+    ('sum', '<f8'),
+    ('min', '<i2'),
+    ('max', '<i2'),
+])
+
+
+def bucket_start(timestamps, resolution):
+    """Start of the bucket of each timestamp (seconds since epoch)."""
+    bucket_size = RESOLUTIONS[resolution][0]
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    if bucket_size < DAY:
+        # Local time differs from UTC by whole hours: buckets of up to an hour
+        # aligned in UTC are aligned in local time as well
+        return timestamps - timestamps % bucket_size
+    local = pd.DatetimeIndex(pd.to_datetime(timestamps, unit='s', utc=True)).tz_convert(TIMEZONE)
+    return np.asarray((local.normalize() - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(seconds=1), dtype=np.int64)
+
+
+def partition_name(timestamp, resolution):
+    local = pd.Timestamp(int(timestamp), unit='s', tz='UTC').tz_convert(TIMEZONE)
+    return local.strftime(RESOLUTIONS[resolution][1])
+
+# =============================================================================
+# Rollup store
+# =============================================================================
+
+class RollupStore:
+    def __init__(self, root=ROLLUPS_DIR, history=history_store):
+        self.root = root
+        self.history = history
+        self._lock = threading.Lock()
+
+    def _path(self, resolution, partition):
+        return os.path.join(self.root, resolution, f"{partition}.npy")
+
+    def _read(self, resolution, partition):
+        try:
+            return pd.DataFrame(np.load(self._path(resolution, partition)))
+        except OSError:
+            return pd.DataFrame(np.empty(0, dtype=ROLLUP_DTYPE))
+
+    def _write(self, resolution, partition, rollup):
+        os.makedirs(os.path.join(self.root, resolution), exist_ok=True)
+        records = rollup.to_records(index=False).astype(ROLLUP_DTYPE)
+        buffer = io.BytesIO()
+        np.save(buffer, records)
+        atomic_write(self._path(resolution, partition), buffer.getvalue())
+
+    def _format_version(self):
+        try:
+            with open(os.path.join(self.root, 'format.json'), 'r') as format_file:
+                return json.load(format_file)['version']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def update(self, rows):
+        """Fold rows appended to the history (dict of arrays with 'timestamp',
+        'garage' and 'occupation') into all rollups."""
+        if len(rows['timestamp']) == 0:
+            return
+        if self._format_version() != FORMAT_VERSION:
+            # Rollups of an older layout (including these rows, which are
+            # already in the history)
+            self.rebuild()
+            return
+        new = pd.DataFrame({
+            'garage': rows['garage'],
+            'timestamp': rows['timestamp'],
+            'occupation': rows['occupation'],
+        })
+        with self._lock:
+            for resolution in RESOLUTIONS:
+                new['bucket'] = bucket_start(new['timestamp'], resolution)
+                aggregated = new.groupby(['garage', 'bucket'], as_index=False).agg(
+                    count=('occupation', 'size'),
+                    sum=('occupation', 'sum'),
+                    min=('occupation', 'min'),
+                    max=('occupation', 'max'),
+                )
+                partitions = aggregated['bucket'].map(lambda bucket: partition_name(bucket, resolution))
+                for partition, part in aggregated.groupby(partitions):
+                    self._write(resolution, partition, self._merge(self._read(resolution, partition), part))
+
+    @staticmethod
+    def _merge(existing, new):
+        # Combine the statistics of buckets present in both
+        combined = pd.concat([existing, new], ignore_index=True)
+        return combined.groupby(['garage', 'bucket'], as_index=False).agg(
+            {'count': 'sum', 'sum': 'sum', 'min': 'min', 'max': 'max'})
+
+    def rebuild(self):
+        """Recompute all rollups from the full history."""
+        with self._lock:
+            for resolution in RESOLUTIONS:
+                directory = os.path.join(self.root, resolution)
+                if os.path.isdir(directory):
+                    for name in os.listdir(directory):
+                        os.remove(os.path.join(directory, name))
+            os.makedirs(self.root, exist_ok=True)
+            atomic_write(os.path.join(self.root, 'format.json'), json.dumps({'version': FORMAT_VERSION}))
+        for partition_dir in self.history.partitions():
+            self.update(self.history.read_partition(partition_dir, ['timestamp', 'garage', 'occupation']))
+
+    # -------------------------------------------------------------------------
+    # Querying
+    # -------------------------------------------------------------------------
+    def choose_resolution(self, start, end, resolution=None, min_points=500):
+        """Coarsest rollup that satisfies the request: the coarsest bucket
+        size not larger than 'resolution' (seconds), or, without a requested
+        resolution, the coarsest one that still gives at least 'min_points'
+        buckets in [start, end]. None means that only the raw history is fine
+        enough."""
+        chosen = None
+        for name, (bucket_size, _) in RESOLUTIONS.items():
+            if resolution is not None:
+                fits = bucket_size <= resolution
+            else:
+                fits = (end - start) / bucket_size >= min_points
+            if fits:
+                chosen = name
+        if chosen is None and resolution is None:
+            chosen = '5min'  # short range: the finest rollup is enough
+        return chosen
+
+    def query(self, start, end, resolution=None, garages=None, min_points=500):
+        """Occupation per garage per bucket in [start, end] as a DataFrame with
+        columns garage, name, bucket, time, count, min, max and mean."""
+        chosen = self.choose_resolution(start, end, resolution, min_points)
+        if chosen is None:
+            # Finer than the finest rollup: every raw sample is its own bucket
+            raw = self.history.scan(start, end, garages, ['timestamp', 'garage', 'occupation'])
+            result = pd.DataFrame({
+                'garage': raw['garage'], 'bucket': raw['timestamp'], 'count': 1,
+                'sum': raw['occupation'], 'min': raw['occupation'], 'max': raw['occupation'],
+            })
+        else:
+            first = partition_name(start, chosen)
+            last = partition_name(end, chosen)
+            directory = os.path.join(self.root, chosen)
+            names = sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+            parts = [self._read(chosen, name[:-len('.npy')]) for name in names
+                     if first <= name[:-len('.npy')] <= last]
+            result = pd.concat(parts, ignore_index=True) if parts else self._read(chosen, '')
+            result = result[(result['bucket'] >= bucket_start([start], chosen)[0]) & (result['bucket'] <= end)]
+            if garages is not None:
+                codes = [self.history.garage_code(garage) for garage in garages]
+                result = result[result['garage'].isin(codes)]
+        result = result.sort_values(['garage', 'bucket']).reset_index(drop=True)
+        result['mean'] = result['sum'] / result['count']
+        names = np.array([garage['name'] for garage in self.history.garages()] or [''], dtype=object)
+        result['name'] = names[result['garage'].to_numpy(dtype=int)]
+        result['time'] = pd.to_datetime(result['bucket'], unit='s', utc=True).dt.tz_convert('Europe/Brussels')
+        return result.drop(columns='sum')
+
+
+# Rollups of this host (updated by the poller)
+rollup_store = RollupStore()
+
+
+if __name__ == '__main__':
+    if '--rebuild' in sys.argv:
+        rollup_store.rebuild()
@@ -0,0 +1,254 @@
+"""
+Append-only history of the garage occupancy.
+
+Every polled snapshot is appended to a small columnar store, so questions like
+"how full is Sint-Pietersplein on Saturday afternoons" can be answered later.
+
+Layout of the store (in '../data/history'):
+    garages.json            dictionary of the garages: code -> {id, name}
+    2024-01-23/             one partition per day (UTC, of 'lastupdate')
+        timestamp.i8        one binary file per column, see COLUMNS
+        garage.u2
+        ...
+
+Appending a snapshot only appends a few bytes to each column file of the
+current partition, it never rewrites the history. Reading a time range only
+opens the partitions of the days in that range (and only the columns asked
+for), and filters them with vectorized NumPy operations.
+"""
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+
+from snapshot_store import DATA_DIR, atomic_write, lock_exclusive
+
+# =============================================================================
+# Settings
+# =============================================================================
+HISTORY_DIR = os.path.join(DATA_DIR, 'history')
+
+# Column name -> NumPy dtype of the column file
+COLUMNS = {
+    'timestamp': np.dtype('<i8'),          # seconds since epoch, from 'lastupdate'
+    'garage': np.dtype('<u2'),             # code in garages.json
+    'availablecapacity': np.dtype('<i4'),
+    'totalcapacity': np.dtype('<i4'),
+    'occupation': np.dtype('<i2'),         # percentage
+    'isopennow': np.dtype('<i1'),
+}
+
+
+def column_path(partition_dir, column):
+    return os.path.join(partition_dir, f"{column}.{COLUMNS[column].str[1:]}")
+
+
+def parse_lastupdate(lastupdate):
+    """'2024-01-23T15:11:46+01:00' -> seconds since epoch."""
+    return int(datetime.fromisoformat(lastupdate).timestamp())
+
+
+def partition_name(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime('%Y-%m-%d')
+
+# =============================================================================
+# History store
+# =============================================================================
+
+class HistoryStore:
+    def __init__(self, root=HISTORY_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+        self._garages = None        # list of {'id': ..., 'name': ...}, index = code
+        self._garages_mtime = None
+
+    # -------------------------------------------------------------------------
+    # Garage dictionary
+    # -------------------------------------------------------------------------
+    @property
+    def garages_file(self):
+        return os.path.join(self.root, 'garages.json')
+
+    def garages(self):
+        """List of garages; the index in the list is the garage code. Re-read
+        when an other process (the poller) added garages."""
+        try:
+            mtime = os.stat(self.garages_file).st_mtime_ns
+        except OSError:
+            mtime = None
+        if self._garages is None or mtime != self._garages_mtime:
+            try:
+                with open(self.garages_file, 'r') as garages_file:
+                    self._garages = json.load(garages_file)
+            except OSError:
+                self._garages = []
+            self._garages_mtime = mtime
+        return self._garages
+
+    def garage_code(self, garage):
+        """Code of a garage given its id or name (None if unknown)."""
+        for code, known_garage in enumerate(self.garages()):
+            if garage in (known_garage['id'], known_garage['name']):
+                return code
+        return None
+
+    def _encode_garage(self, record):
+        garage_id = record.get('id') or record['name']
+        code = self.garage_code(garage_id)
+        if code is None:
+            # New garage: extend the dictionary (existing codes never change)
+            garages = self.garages() + [{'id': garage_id, 'name': record['name']}]
+            atomic_write(self.garages_file, json.dumps(garages))
+            code = len(garages) - 1
+        return code
+
+    # -------------------------------------------------------------------------
+    # Appending
+    # -------------------------------------------------------------------------
+    @property
+    def lock_file(self):
+        return os.path.join(self.root, 'append.lock')
+
+    def append(self, records):
+        """Append the records of one snapshot. Records of which the
+        'lastupdate' was already stored for that garage are skipped. Returns
+        the appended rows as a dict of NumPy arrays (one per column).
+
+        Any process can append (the poller, or a worker handling the Update
+        button), so what is stored is looked up on disk, under a lock file,
+        at every append."""
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock, open(self.lock_file, 'a') as lock_file:
+            lock_exclusive(lock_file)
+            rows = {}  # partition -> list of rows
+            last_timestamps = {}  # partition -> {garage code: last stored timestamp}
+            for record in records:
+                if record.get('lastupdate') is None:
+                    continue
+                code = self._encode_garage(record)
+                timestamp = parse_lastupdate(record['lastupdate'])
+                partition = partition_name(timestamp)
+                if partition not in last_timestamps:
+                    last_timestamps[partition] = self._last_timestamps(os.path.join(self.root, partition))
+                if last_timestamps[partition].get(code, -1) >= timestamp:
+                    continue
+                last_timestamps[partition][code] = timestamp
+                rows.setdefault(partition_name(timestamp), []).append((
+                    timestamp,
+                    code,
+                    record.get('availablecapacity') or 0,
+                    record.get('totalcapacity') or 0,
+                    record.get('occupation') or 0,
+                    record.get('isopennow') or 0,
+                ))
+            for partition, partition_rows in rows.items():
+                self._append_rows(os.path.join(self.root, partition), partition_rows)
+            appended = [row for partition_rows in rows.values() for row in partition_rows]
+            return {column: np.array([row[index] for row in appended], dtype=COLUMNS[column])
+                    for index, column in enumerate(COLUMNS)}
+
+    def _last_timestamps(self, partition_dir):
+        """Last stored timestamp per garage code in a partition. A record can
+        only be a duplicate of a row in its own partition (the partition
+        follows from the timestamp), so one day of two columns is enough."""
+        columns = self.read_partition(partition_dir, ['timestamp', 'garage'])
+        if len(columns['timestamp']) == 0:
+            return {}
+        order = np.lexsort((columns['timestamp'], columns['garage']))
+        garages, timestamps = columns['garage'][order], columns['timestamp'][order]
+        last = np.flatnonzero(np.append(garages[1:] != garages[:-1], True))
+        return {int(garages[index]): int(timestamps[index]) for index in last}
+
+    def _append_rows(self, partition_dir, rows):
+        os.makedirs(partition_dir, exist_ok=True)
+        self._repair(partition_dir)
+        values = list(zip(*rows))
+        for column, column_values in zip(COLUMNS, values):
+            with open(column_path(partition_dir, column), 'ab') as column_file:
+                np.asarray(column_values, dtype=COLUMNS[column]).tofile(column_file)
+
+    def _repair(self, partition_dir):
+        """Truncate all columns to the same number of rows, in case an earlier
+        append was interrupted halfway."""
+        lengths = {column: self._column_length(partition_dir, column) for column in COLUMNS}
+        rows = min(lengths.values())
+        for column, length in lengths.items():
+            if length != rows:
+                os.truncate(column_path(partition_dir, column), rows * COLUMNS[column].itemsize)
+
+    def _column_length(self, partition_dir, column):
+        try:
+            return os.path.getsize(column_path(partition_dir, column)) // COLUMNS[column].itemsize
+        except OSError:
+            return 0
+
+    # -------------------------------------------------------------------------
+    # Reading
+    # -------------------------------------------------------------------------
+    def partitions(self, start=None, end=None):
+        """Partition folders overlapping [start, end] (seconds since epoch)."""
+        if not os.path.isdir(self.root):
+            return []
+        first = partition_name(start) if start is not None else None
+        last = partition_name(end) if end is not None else None
+        partitions = []
+        for name in sorted(os.listdir(self.root)):
+            path = os.path.join(self.root, name)
+            if not name[:1].isdigit() or not os.path.isdir(path):
+                continue  # garages.json, rollups/, ...
+            if (first is None or name >= first) and (last is None or name <= last):
+                partitions.append(path)
+        return partitions
+
+    def read_partition(self, partition_dir, columns):
+        rows = min(self._column_length(partition_dir, column) for column in COLUMNS)
+        result = {}
+        for column in columns:
+            if rows == 0:
+                result[column] = np.empty(0, dtype=COLUMNS[column])
+            else:
+                result[column] = np.fromfile(column_path(partition_dir, column),
+                                             dtype=COLUMNS[column], count=rows)
+        return result
+
+    def scan(self, start=None, end=None, garages=None, columns=None):
+        """Return the rows with start <= timestamp <= end (seconds since epoch)
+        of the given garages (ids or names; all if None) as a dict of NumPy
+        arrays, in the order in which they were appended."""
+        columns = list(columns or COLUMNS)
+        read_columns = list(dict.fromkeys(['timestamp', 'garage'] + columns))
+        if garages is not None:
+            codes = [self.garage_code(garage) for garage in garages]
+            codes = np.array([code for code in codes if code is not None], dtype=COLUMNS['garage'])
+        parts = []
+        for partition_dir in self.partitions(start, end):
+            part = self.read_partition(partition_dir, read_columns)
+            mask = np.ones(len(part['timestamp']), dtype=bool)
+            if start is not None:
+                mask &= part['timestamp'] >= start
+            if end is not None:
+                mask &= part['timestamp'] <= end
+            if garages is not None:
+                mask &= np.isin(part['garage'], codes)
+            parts.append({column: part[column][mask] for column in columns})
+        if not parts:
+            return {column: np.empty(0, dtype=COLUMNS[column]) for column in columns}
+        return {column: np.concatenate([part[column] for part in parts]) for column in columns}
+
+    def scan_df(self, start=None, end=None, garages=None, columns=None):
+        """Same as scan(), as a pandas DataFrame with the garage names."""
+        import pandas as pd
+
+        result = pd.DataFrame(self.scan(start, end, garages, columns))
+        if 'garage' in result:
+            names = np.array([garage['name'] for garage in self.garages()] or [''], dtype=object)
+            result['name'] = names[result['garage'].to_numpy()]
+        if 'timestamp' in result:
+            result['time'] = pd.to_datetime(result['timestamp'], unit='s', utc=True).dt.tz_convert('Europe/Brussels')
+        return result
+
+
+# History of this host (appended to by the poller)
+history_store = HistoryStore()
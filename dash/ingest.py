@@ -0,0 +1,278 @@
+"""
+Background ingestion of the Stad Gent parking garage API.
+
+Exactly one poller per host fetches the upstream data on a fixed schedule and
+publishes it to the data folder. The Dash callbacks only ever read the latest
+published snapshot, so upstream load no longer scales with the number of open
+browser tabs or gunicorn workers.
+
+The poller either runs inside one of the gunicorn workers (elected through an
+exclusive lock on '../data/ingest.lock') or as a separate sidecar process:
+
+    python3 ingest.py
+"""
+import fcntl
+import locale
+import os
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+from api_client import NOT_MODIFIED
+from forecast import fit_profiles_if_outdated
+from history_rollups import rollup_store
+from history_store import history_store
+from metrics import FETCH_SECONDS, FETCHES, UPSTREAM_ERRORS
+from opendatasoft import BASE_URL, OpendatasoftClient
+from snapshot_store import (DATA_DIR, content_hash, lock_exclusive, publish_snapshot, read_manifest,
+                            read_ingest_status, serialize_records, write_ingest_status)
+
+# =============================================================================
+# Settings
+# =============================================================================
+LOCK_FILE = os.path.join(DATA_DIR, 'ingest.lock')
+# Held during every fetch (poller or Update button), so fetches never overlap
+FETCH_LOCK_FILE = os.path.join(DATA_DIR, 'fetch.lock')
+
+# Overridable to fetch from the local replay server (see replay_api.py)
+API_URL = os.environ.get('PARKINGS_API_URL', BASE_URL)
+DATASET = 'bezetting-parkeergarages-real-time'
+# Only the fields used by the app and the history (not e.g. the long
+# 'description' and 'locationanddimension')
+FIELDS = ['name', 'lastupdate', 'totalcapacity', 'availablecapacity', 'occupation',
+          'isopennow', 'temporaryclosed', 'id', 'location']
+# "The Loop" is filtered out server-side
+WHERE = 'name != "The Loop"'
+
+# Seconds between two upstream requests (one request per interval per host)
+POLL_INTERVAL = int(os.environ.get('PARKINGS_POLL_INTERVAL', 60))
+
+# 'worker' (default): poll from within an elected gunicorn worker
+# 'sidecar': polling is done by a separate 'python3 ingest.py' process
+INGEST_MODE = os.environ.get('PARKINGS_INGEST_MODE', 'worker')
+
+# Dutch month names in the update time of the snapshots
+TIME_LOCALE = 'nl_BE.utf-8'
+
+# Update button: clicks within this many seconds after the last fetch are
+# served from the cache, and a click waits at most REFRESH_WAIT seconds for
+# the fetch (a later result reaches the browser through the server push).
+# The last fetch is usually the poller's: the throttle must be clearly shorter
+# than POLL_INTERVAL, or the button would (almost) never fetch. With the
+# default interval of 60 s a click fetches if the data is 15 s or older.
+MIN_REFRESH_INTERVAL = max(5, POLL_INTERVAL // 4)
+REFRESH_WAIT = 3
+
+# =============================================================================
+# Fetch data
+# =============================================================================
+
+# Called (without arguments) after every newly published snapshot, e.g. by the
+# static export (see static_export.py)
+publish_hooks = []
+
+# Paginating Opendatasoft client on top of the pooled, conditional ApiClient
+# (keep-alive, timeouts, retries with backoff)
+ods_client = OpendatasoftClient(API_URL)
+
+_time_locale_set = False
+
+def set_time_locale():
+    """Set the Belgian locale for the update time (once, on the first fetch:
+    the web workers never format times themselves)."""
+    global _time_locale_set
+    if not _time_locale_set:
+        try:
+            locale.setlocale(locale.LC_TIME, TIME_LOCALE)
+        except locale.Error:
+            print(f"Locale {TIME_LOCALE} is not available, the update time is not in Dutch")
+        _time_locale_set = True
+
+
+# Fetching data function
+def fetch_data():
+    try:
+        filtered_data = ods_client.list_records(DATASET, select=FIELDS, where=WHERE, conditional=True)
+    except requests.RequestException as error:
+        print(f"Failed to fetch data: {error}")
+        UPSTREAM_ERRORS.labels(type(error).__name__).inc()
+        FETCHES.labels('error').inc()
+        return False
+    if filtered_data is NOT_MODIFIED:
+        FETCHES.labels('not_modified').inc()
+        return True  # 304: the published snapshot is still up to date
+
+    # Nothing to publish if the data did not change since the last snapshot
+    manifest = read_manifest()
+    if manifest and manifest['sha256'] == content_hash(serialize_records(filtered_data)):
+        FETCHES.labels('unchanged').inc()
+        return True
+
+    # Publish data and update time as a new snapshot (atomic, versioned)
+    set_time_locale()
+    current_time = datetime.now().strftime("%d %B %Y - %H:%M:%S")
+    publish_snapshot(filtered_data, current_time)
+    FETCHES.labels('published').inc()
+
+    # Keep the occupancy history, its rollups and the forecast profiles
+    # (a failure here must not stop publishing)
+    try:
+        rollup_store.update(history_store.append(filtered_data))
+        fit_profiles_if_outdated()
+    except Exception as error:
+        print(f"Failed to append to history: {error}")
+    for hook in publish_hooks:
+        try:
+            hook()
+        except Exception as error:
+            print(f"Failed to run {hook.__name__} after publishing: {error}")
+    return True
+
+# =============================================================================
+# Circuit breaker
+# =============================================================================
+
+class CircuitBreaker:
+    """Stop calling the API for a while after repeated failures. The pause
+    doubles with every further failure (up to max_cooldown); one successful
+    fetch closes the breaker again. The state is kept in the status file, so
+    the poller and the Update button share it."""
+    def __init__(self, failure_threshold=3, base_cooldown=2 * POLL_INTERVAL, max_cooldown=30 * 60):
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+
+    def allow(self, status):
+        return time.time() >= (status.get('open_until') or 0)
+
+    def record(self, status, success):
+        if success:
+            status['consecutive_failures'] = 0
+            status['open_until'] = 0
+            return
+        failures = status['consecutive_failures'] = (status.get('consecutive_failures') or 0) + 1
+        if failures >= self.failure_threshold:
+            exponent = failures - self.failure_threshold
+            status['open_until'] = time.time() + min(self.max_cooldown, self.base_cooldown * 2 ** exponent)
+
+
+breaker = CircuitBreaker()
+
+
+# Fetches within this process (poller and Update button) take turns here first,
+# so the host wide fetch lock is only contended between processes
+_fetch_lock = threading.Lock()
+
+
+def poll_once(min_interval=0):
+    """One fetch guarded by the circuit breaker, under the host wide fetch
+    lock. Skipped if a fetch started less than 'min_interval' seconds ago
+    (concurrent callers wait for the fetch in flight and then skip). The
+    outcome is written to the status file so the app can show when its data is
+    stale. Returns whether a fetch was done."""
+    with _fetch_lock, open(FETCH_LOCK_FILE, 'a') as lock_file:
+        lock_exclusive(lock_file)
+        status = read_ingest_status() or {}
+        now = time.time()
+        if now - (status.get('last_attempt') or 0) < min_interval or not breaker.allow(status):
+            return False
+        # Written before fetching, so Update clicks during the fetch see it
+        status['last_attempt'] = now
+        write_ingest_status(status)
+        try:
+            with FETCH_SECONDS.time():
+                success = fetch_data()
+        except Exception as error:  # never let the poller thread die
+            print(f"Failed to fetch data: {error}")
+            success = False
+        if success:
+            status['last_success'] = now
+        breaker.record(status, success)
+        write_ingest_status(status)
+        return True
+
+# =============================================================================
+# Update button: coalesced refresh
+# =============================================================================
+
+_refresh_lock = threading.Lock()
+_refresh_in_flight = None
+
+def _refresh(done):
+    global _refresh_in_flight
+    try:
+        poll_once(min_interval=MIN_REFRESH_INTERVAL)
+    finally:
+        with _refresh_lock:
+            _refresh_in_flight = None
+        done.set()
+
+
+def request_refresh(wait=REFRESH_WAIT):
+    """Ask for fresh data (Update button). All clicks in this worker share one
+    fetch in flight, and the fetch lock coalesces clicks across workers with
+    the poller. Returns whether the fetch finished within 'wait' seconds."""
+    global _refresh_in_flight
+    status = read_ingest_status() or {}
+    if time.time() - (status.get('last_attempt') or 0) < MIN_REFRESH_INTERVAL:
+        return True  # fetched recently: the cache is fresh enough
+    with _refresh_lock:
+        if _refresh_in_flight is None:
+            _refresh_in_flight = threading.Event()
+            threading.Thread(target=_refresh, args=(_refresh_in_flight,), name='parkings-refresh', daemon=True).start()
+        done = _refresh_in_flight
+    return done.wait(wait)
+
+# =============================================================================
+# Poller election and loop
+# =============================================================================
+
+def acquire_ingest_lock():
+    """Try to become the poller of this host. Returns the locked file (keep it
+    open to hold the lock) or None if another process already polls."""
+    lock_file = open(LOCK_FILE, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def run_poller(stop_event=None, interval=POLL_INTERVAL):
+    """Poll the API every 'interval' seconds for as long as this process holds
+    the ingest lock. Processes that lose the election keep retrying, so that
+    polling resumes when the elected worker is restarted by gunicorn."""
+    stop_event = stop_event or threading.Event()
+    lock_file = None
+    while not stop_event.is_set():
+        if lock_file is None:
+            lock_file = acquire_ingest_lock()
+        if lock_file is not None:
+            poll_once()
+        stop_event.wait(interval)
+    if lock_file is not None:
+        lock_file.close()
+
+
+_poller_thread = None
+
+def start_background_poller():
+    """Start the poller thread in this process (once). Does nothing when the
+    ingestion runs as a sidecar process."""
+    global _poller_thread
+    if INGEST_MODE == 'sidecar' or _poller_thread is not None:
+        return _poller_thread
+    _poller_thread = threading.Thread(target=run_poller, name='parkings-poller', daemon=True)
+    _poller_thread.start()
+    return _poller_thread
+
+
+if __name__ == '__main__':
+    # Sidecar mode: poll in the foreground until interrupted
+    try:
+        run_poller()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,412 @@
+"""
+Load test: many concurrent dashboard viewers.
+
+Every virtual viewer behaves like a browser with the dashboard open: it loads
+the page ('/', '_dash-layout', '_dash-dependencies' and the initial
+update_data callback) and keeps the server push open ('events', as
+assets/push.js does). Every new snapshot version that arrives there triggers
+update_data at once, so all viewers ask for it in the same burst, as in
+production. In between, after a think time, a viewer repeatedly
+    - clicks the Update button (update_data triggered by 'refresh-btn'),
+    - zooms the map (update_data triggered by 'relayoutData'),
+    - or reloads the page (which also reconnects the server push).
+Switching the display option happens in the browser (assets/views.js), so it
+causes no requests.
+
+Reports the throughput and the p50/p95/p99 latency per request type
+('events' is the time until the first message of the server push), and the
+peak number of open server push connections: each gevent worker holds at most
+worker_connections of them (see gunicorn_config.py).
+Either test a running app:
+
+    python3 load_test.py --url http://127.0.0.1:5001/visualisaties/parkeergarages-gent/ --users 200
+
+or let the script start the app under gunicorn (gunicorn_config.py) on a copy
+of the data, fetching from the local replay API (see replay_api.py):
+
+    python3 load_test.py --start-app --workers 7 --users 200 --duration 60
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+DASH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PREFIX = '/visualisaties/parkeergarages-gent/'
+
+# Relative frequency of the actions of a viewer (after the page load)
+ACTIONS = {
+    'refresh_click': 0.35,
+    'zoom': 0.50,
+    'reload': 0.15,
+}
+
+# Seconds before reconnecting a dropped server push (as EventSource does)
+RECONNECT_DELAY = 10
+
+UPDATE_DATA_OUTPUTS = [('live-update-graph', 'figure'), ('last-update-time', 'children'),
+                       ('zones-level', 'data'), ('figure-state', 'data')]
+
+# =============================================================================
+# Statistics
+# =============================================================================
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}  # request type -> list of seconds
+        self.errors = {}
+        self.bytes = {}
+        self.open_streams = 0
+        self.peak_streams = 0
+        self.pushes = 0  # new versions received over the server push
+
+    def record(self, name, seconds, size, error=False):
+        with self._lock:
+            self.latencies.setdefault(name, []).append(seconds)
+            self.bytes[name] = self.bytes.get(name, 0) + size
+            if error:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def stream_summary(self):
+        return {'peak_open': self.peak_streams, 'pushes_received': self.pushes}
+
+    def stream_opened(self):
+        with self._lock:
+            self.open_streams += 1
+            self.peak_streams = max(self.peak_streams, self.open_streams)
+
+    def stream_closed(self):
+        with self._lock:
+            self.open_streams -= 1
+
+    def push_received(self):
+        with self._lock:
+            self.pushes += 1
+
+    def summary(self, duration):
+        result = {}
+        for name, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            result[name] = {
+                'requests': len(latencies),
+                'errors': self.errors.get(name, 0),
+                'throughput': round(len(latencies) / duration, 2),  # per second
+                'mean_bytes': round(self.bytes[name] / len(latencies)),
+                'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+                'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+                'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+                'max_ms': round(latencies[-1] * 1000, 1),
+            }
+        return result
+
+
+def percentile(sorted_values, percent):
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    return statistics.quantiles(sorted_values, n=100, method='inclusive')[percent - 1]
+
+# =============================================================================
+# Virtual viewer
+# =============================================================================
+
+def find_prop(layout, component_id, prop):
+    """Value of a property of a component in a serialized Dash layout."""
+    stack = [layout]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            props = node.get('props')
+            if isinstance(props, dict) and props.get('id') == component_id:
+                return props.get(prop)
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(node)
+    return None
+
+
+class Viewer:
+    def __init__(self, base_url, stats, think_time, rng):
+        self.base_url = base_url
+        self.stats = stats
+        self.think_time = think_time
+        self.rng = rng
+        self.session = requests.Session()
+        self.figure_state = None
+        self.zones_level = 0
+        self.n_clicks = {'push-trigger': None, 'refresh-btn': None}
+        # The page state is shared with the thread listening to the server push
+        self._lock = threading.RLock()
+        self._stopped = threading.Event()
+        self._events = None  # response of the open server push
+
+    def request(self, name, method, path, **kwargs):
+        start = time.perf_counter()
+        for attempt in range(2):
+            try:
+                response = self.session.request(method, self.base_url + path, timeout=60, **kwargs)
+                break
+            except requests.ConnectionError:
+                # Like a browser, retry once on a new connection when the
+                # server closed the idle keep-alive connection meanwhile
+                self.session.close()
+                if attempt == 1:
+                    self.stats.record(name, time.perf_counter() - start, 0, error=True)
+                    return None
+            except requests.RequestException:
+                self.stats.record(name, time.perf_counter() - start, 0, error=True)
+                return None
+        self.stats.record(name, time.perf_counter() - start, len(response.content),
+                          error=response.status_code not in (200, 204))
+        return response
+
+    def open_page(self):
+        self.request('page', 'GET', '')
+        layout = self.request('_dash-layout', 'GET', '_dash-layout')
+        self.request('_dash-dependencies', 'GET', '_dash-dependencies')
+        if layout is not None and layout.status_code == 200:
+            layout = layout.json()
+            self.figure_state = find_prop(layout, 'figure-state', 'data')
+            self.zones_level = find_prop(layout, 'zones-level', 'data') or 0
+        self.update_data('initial_callback', None)
+
+    def update_data(self, name, trigger, relayout_data=None):
+        with self._lock:
+            self._update_data(name, trigger, relayout_data)
+
+    def _update_data(self, name, trigger, relayout_data):
+        if trigger in self.n_clicks:
+            self.n_clicks[trigger] = (self.n_clicks[trigger] or 0) + 1
+        body = {
+            'output': '..' + '...'.join(f"{component}.{prop}" for component, prop in UPDATE_DATA_OUTPUTS) + '..',
+            'outputs': [{'id': component, 'property': prop} for component, prop in UPDATE_DATA_OUTPUTS],
+            'inputs': [
+                {'id': 'push-trigger', 'property': 'n_clicks', 'value': self.n_clicks['push-trigger']},
+                {'id': 'refresh-btn', 'property': 'n_clicks', 'value': self.n_clicks['refresh-btn']},
+                {'id': 'live-update-graph', 'property': 'relayoutData', 'value': relayout_data},
+            ],
+            'state': [
+                {'id': 'display-option', 'property': 'value', 'value': 'parkings'},
+                {'id': 'zones-level', 'property': 'data', 'value': self.zones_level},
+                {'id': 'figure-state', 'property': 'data', 'value': self.figure_state},
+            ],
+            'changedPropIds': [f"{trigger}.{'relayoutData' if trigger == 'live-update-graph' else 'n_clicks'}"]
+                              if trigger else [],
+        }
+        response = self.request(name, 'POST', '_dash-update-component', json=body)
+        if response is not None and response.status_code == 200:
+            outputs = response.json().get('response', {})
+            self.figure_state = outputs.get('figure-state', {}).get('data', self.figure_state)
+            self.zones_level = outputs.get('zones-level', {}).get('data', self.zones_level)
+
+    def listen(self):
+        """Keep the server push open, like assets/push.js: the first message
+        is the version the page shows, every other version triggers
+        update_data. Reconnects when the connection drops."""
+        session = requests.Session()
+        while not self._stopped.is_set():
+            start = time.perf_counter()
+            try:
+                response = session.get(self.base_url + 'events', stream=True, timeout=(10, 60))
+            except requests.RequestException:
+                self.stats.record('events', time.perf_counter() - start, 0, error=True)
+                self._stopped.wait(RECONNECT_DELAY)
+                continue
+            if response.status_code != 200:
+                self.stats.record('events', time.perf_counter() - start, 0, error=True)
+                response.close()
+                self._stopped.wait(RECONNECT_DELAY)
+                continue
+            self._events = response
+            self.stats.stream_opened()
+            dropped = False
+            try:
+                version = None
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith('data:'):
+                        continue  # 'retry:' and heartbeats
+                    new_version = line[len('data:'):].strip()
+                    if version is None:
+                        self.stats.record('events', time.perf_counter() - start, 0)
+                    elif new_version != version:
+                        self.stats.push_received()
+                        self.update_data('push_update', 'push-trigger')
+                    version = new_version
+                dropped = True  # the server ended the stream
+            except Exception:
+                # Closed by reconnect()/stop(), or dropped by the server
+                dropped = self._events is response
+            finally:
+                self.stats.stream_closed()
+                response.close()
+            if dropped and not self._stopped.is_set():
+                self.stats.record('events', time.perf_counter() - start, 0, error=True)
+                self._stopped.wait(RECONNECT_DELAY)
+
+    def reconnect(self):
+        """Close the server push; listen() opens a new one (page reload)."""
+        events, self._events = self._events, None
+        if events is not None:
+            events.close()
+
+    def act(self):
+        action = self.rng.choices(list(ACTIONS), weights=list(ACTIONS.values()))[0]
+        if action == 'refresh_click':
+            self.update_data('refresh_click', 'refresh-btn')
+        elif action == 'zoom':
+            self.update_data('zoom', 'live-update-graph', {'mapbox.zoom': self.rng.uniform(11, 16)})
+        else:
+            self.reconnect()
+            with self._lock:
+                self.open_page()
+
+    def run(self, stop_at):
+        with self._lock:
+            self.open_page()
+        threading.Thread(target=self.listen, daemon=True).start()
+        while True:
+            pause = self.rng.expovariate(1 / self.think_time) if self.think_time else 0
+            if time.time() + pause >= stop_at:
+                break
+            time.sleep(pause)
+            self.act()
+        time.sleep(max(0.0, stop_at - time.time()))
+        self._stopped.set()
+        self.reconnect()
+
+# =============================================================================
+# Running the app under test
+# =============================================================================
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+class LocalApp:
+    """The app under gunicorn on a copy of the data folder, fetching from the
+    replay API."""
+    def __init__(self, workers, replay_arguments):
+        from replay_api import DATA_DIR, ReplayApi, ReplayData, load_snapshots
+
+        self.data_dir = tempfile.mkdtemp(prefix='parkings-load-test-')
+        for name in ('fetched_data.json', 'last_update.txt', 'parking_zones_ghent-traces.json'):
+            shutil.copy(os.path.join(DATA_DIR, name), self.data_dir)
+        data = ReplayData(load_snapshots(os.path.join(DATA_DIR, 'fetched_data.json')),
+                          drift=replay_arguments.drift, drift_interval=replay_arguments.drift_interval)
+        self.replay = ReplayApi(data, latency=replay_arguments.api_latency,
+                                error_rate=replay_arguments.api_error_rate).start()
+        self.port = free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}{APP_PREFIX}"
+        env = dict(os.environ, PARKINGS_DATA_DIR=self.data_dir, PARKINGS_API_URL=self.replay.base_url,
+                   PARKINGS_POLL_INTERVAL=str(replay_arguments.poll_interval))
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn_config.py', '-w', str(workers),
+             '-b', f"127.0.0.1:{self.port}", 'parkings_ghent_app_dash:application'],
+            cwd=DASH_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def wait_until_ready(self, timeout=60):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                if requests.get(self.base_url + '_dash-layout', timeout=5).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            if self.process.poll() is not None:
+                break
+            time.sleep(0.2)
+        raise RuntimeError("The app did not start")
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.replay.close()
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+# =============================================================================
+# Main
+# =============================================================================
+
+def run_load_test(base_url, users, duration, ramp_up, think_time, seed):
+    stats = Stats()
+    stop_at = time.time() + ramp_up + duration
+    threads = []
+    for index in range(users):
+        viewer = Viewer(base_url, stats, think_time, random.Random(seed + index))
+        thread = threading.Thread(target=viewer.run, args=(stop_at,), daemon=True)
+        threads.append(thread)
+        thread.start()
+        time.sleep(ramp_up / users)
+    for thread in threads:
+        thread.join(think_time + 60 + max(0.0, stop_at - time.time()))
+    return stats.summary(ramp_up + duration), stats.stream_summary()
+
+
+def print_summary(summary, streams):
+    print(f"{'request':<20} {'count':>7} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'max ms':>8} {'bytes':>9}")
+    for name, result in summary.items():
+        print(f"{name:<20} {result['requests']:7d} {result['errors']:7d} {result['throughput']:8.1f} "
+              f"{result['p50_ms']:8.1f} {result['p95_ms']:8.1f} {result['p99_ms']:8.1f} "
+              f"{result['max_ms']:8.1f} {result['mean_bytes']:9d}")
+    print(f"\nserver push: at most {streams['peak_open']} connections open at once, "
+          f"{streams['pushes_received']} new versions received")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default=f"http://127.0.0.1:5001{APP_PREFIX}")
+    parser.add_argument('--users', type=int, default=50, help="concurrent viewers")
+    parser.add_argument('--duration', type=float, default=30, help="seconds, after the ramp-up")
+    parser.add_argument('--ramp-up', type=float, default=5, help="seconds over which the viewers start")
+    parser.add_argument('--think-time', type=float, default=5, help="mean seconds between two actions")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="JSON file for the results")
+    local = parser.add_argument_group('local app (--start-app)')
+    local.add_argument('--start-app', action='store_true', help="start the app under gunicorn")
+    local.add_argument('--workers', type=int, default=7)
+    local.add_argument('--poll-interval', type=int, default=10)
+    local.add_argument('--api-latency', type=float, default=0.1)
+    local.add_argument('--api-error-rate', type=float, default=0.0)
+    local.add_argument('--drift', type=float, default=0.02)
+    local.add_argument('--drift-interval', type=float, default=10)
+    arguments = parser.parse_args()
+
+    app = None
+    base_url = arguments.url if arguments.url.endswith('/') else arguments.url + '/'
+    if arguments.start_app:
+        app = LocalApp(arguments.workers, arguments)
+        app.wait_until_ready()
+        base_url = app.base_url
+    try:
+        summary, streams = run_load_test(base_url, arguments.users, arguments.duration, arguments.ramp_up,
+                                arguments.think_time, arguments.seed)
+    finally:
+        if app is not None:
+            app.stop()
+
+    print_summary(summary, streams)
+    if arguments.output:
+        with open(arguments.output, 'w') as output_file:
+            json.dump({'users': arguments.users, 'duration': arguments.duration,
+                       'think_time': arguments.think_time, 'requests': summary, 'server_push': streams},
+                      output_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
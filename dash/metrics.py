@@ -0,0 +1,104 @@
+"""
+Prometheus metrics of the app, served on '<app prefix>/metrics'.
+
+Instrumented: fetches from the upstream API (duration, outcome, errors and
+bytes), snapshot loading, the figure builds, the caches (hits and misses) and
+every Dash callback (duration and response size).
+
+Gunicorn workers are separate processes, each with its own counters. When
+PROMETHEUS_MULTIPROC_DIR is set (gunicorn_config.py does this) every process
+writes its samples to memory-mapped files in that folder, and '/metrics'
+aggregates the files of all workers (and of the sidecar poller, if it runs
+with the same folder). Without it, e.g. on the development server, only the
+metrics of the current process are shown.
+"""
+import os
+import time
+
+from flask import Response, request
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess)
+
+# =============================================================================
+# Metrics
+# =============================================================================
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+FETCH_SECONDS = Histogram(
+    'parkings_fetch_duration_seconds', "Duration of a fetch of the upstream API (incl. publishing)",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+FETCHES = Counter(
+    'parkings_fetches_total', "Fetches of the upstream API by outcome",
+    ['result'])  # published, unchanged, not_modified, error
+UPSTREAM_ERRORS = Counter(
+    'parkings_upstream_errors_total', "Failed requests to the upstream API (after retries)",
+    ['kind'])  # exception class, e.g. HTTPError, ConnectTimeout
+UPSTREAM_BYTES = Counter(
+    'parkings_upstream_bytes_total', "Payload bytes received from the upstream API")
+
+SNAPSHOT_LOAD_SECONDS = Histogram(
+    'parkings_snapshot_load_duration_seconds', "Duration of reading and parsing a new snapshot",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1))
+FIGURE_BUILD_SECONDS = Histogram(
+    'parkings_figure_build_duration_seconds', "Duration of building a figure",
+    ['figure'],  # parkings, forecast, all
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+CACHE_REQUESTS = Counter(
+    'parkings_cache_requests_total', "Cache lookups by cache and result",
+    ['cache', 'result'])  # cache: snapshot, figure; result: hit, miss
+
+CALLBACK_SECONDS = Histogram(
+    'parkings_callback_duration_seconds', "Duration of a Dash callback request",
+    ['callback'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+CALLBACK_BYTES = Histogram(
+    'parkings_callback_response_bytes', "Size of the response of a Dash callback",
+    ['callback'], buckets=SIZE_BUCKETS)
+
+# =============================================================================
+# Route and callback instrumentation
+# =============================================================================
+
+def collect():
+    """Metrics of all processes (multiprocess mode) or of this process."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
+
+def callback_name(app, body):
+    """Name of the callback of a '_dash-update-component' request: its first
+    output, e.g. 'live-update-graph.figure' ('unknown' for outputs that are
+    not a registered callback, to bound the number of label values)."""
+    outputs = (body or {}).get('output', '')
+    if outputs not in app.callback_map:
+        return 'unknown'
+    return outputs.strip('.').split('...')[0]
+
+
+def register_metrics_route(app):
+    """Add the '<app prefix>/metrics' route to the Flask server of a Dash app
+    and time all its callback requests."""
+    server = app.server
+    update_path = app.config.routes_pathname_prefix + '_dash-update-component'
+
+    @server.before_request
+    def start_timer():
+        if request.path == update_path:
+            request.environ['parkings.start'] = time.perf_counter()
+
+    @server.after_request
+    def observe_callback(response):
+        start = request.environ.get('parkings.start')
+        if start is not None:
+            name = callback_name(app, request.get_json(silent=True))
+            CALLBACK_SECONDS.labels(name).observe(time.perf_counter() - start)
+            CALLBACK_BYTES.labels(name).observe(response.calculate_content_length() or 0)
+        return response
+
+    @server.route(app.config.routes_pathname_prefix + 'metrics')
+    def metrics():
+        return Response(collect(), mimetype=CONTENT_TYPE_LATEST)
@@ -0,0 +1,129 @@
+"""
+Connector for the Opendatasoft Explore API v2.1 (used by data.stad.gent).
+
+- records endpoint: transparent pagination, records are yielded one by one
+- exports endpoint: streamed line by line (jsonl) or to a file (geojson, csv,
+  ...), so large datasets are never held in memory as a whole
+- 'select' to only download the fields that are used (e.g. not the long
+  'description' and 'locationanddimension' of the parking garages) and
+  'where' to filter server-side
+
+Example:
+
+    ods = OpendatasoftClient()
+    for record in ods.iter_records('bezetting-parkeergarages-real-time',
+                                   select=['name', 'availablecapacity'],
+                                   where='name != "The Loop"'):
+        print(record)
+"""
+import json
+
+from api_client import NOT_MODIFIED, ApiClient
+
+# =============================================================================
+# Settings
+# =============================================================================
+BASE_URL = "https://data.stad.gent/api/explore/v2.1"
+
+# Maximum page size of the records endpoint, and the maximum offset + limit it
+# accepts (use the exports endpoint for more records)
+MAX_PAGE_SIZE = 100
+MAX_RECORDS_WINDOW = 10000
+
+# =============================================================================
+# Client
+# =============================================================================
+
+class OpendatasoftClient:
+    def __init__(self, base_url=BASE_URL, api_client=None):
+        self.base_url = base_url.rstrip('/')
+        self.api_client = api_client or ApiClient()
+        self._total_counts = {}  # query -> total_count of the last full fetch
+
+    def _dataset_url(self, dataset, endpoint):
+        return f"{self.base_url}/catalog/datasets/{dataset}/{endpoint}"
+
+    @staticmethod
+    def _query(select=None, where=None, order_by=None):
+        params = {}
+        if select:
+            params['select'] = ','.join(select) if not isinstance(select, str) else select
+        if where:
+            params['where'] = where
+        if order_by:
+            params['order_by'] = order_by
+        return params
+
+    # -------------------------------------------------------------------------
+    # Records endpoint
+    # -------------------------------------------------------------------------
+    def get_records_page(self, dataset, offset=0, page_size=MAX_PAGE_SIZE, conditional=False, **query):
+        """One page of the records endpoint: the parsed response (with
+        'total_count' and 'results'), or NOT_MODIFIED."""
+        params = dict(self._query(**query), limit=page_size, offset=offset)
+        return self.api_client.get_json(self._dataset_url(dataset, 'records'), params, conditional)
+
+    def iter_records(self, dataset, select=None, where=None, order_by=None, page_size=MAX_PAGE_SIZE, limit=None):
+        """Yield all records of a query, fetching page after page."""
+        query = dict(select=select, where=where, order_by=order_by)
+        offset = 0
+        while limit is None or offset < limit:
+            size = page_size if limit is None else min(page_size, limit - offset)
+            if offset + size > MAX_RECORDS_WINDOW:
+                raise ValueError(f"The records endpoint is limited to {MAX_RECORDS_WINDOW} records, "
+                                 "use iter_export() instead")
+            page = self.get_records_page(dataset, offset, size, **query)
+            results = page.get('results', [])
+            yield from results
+            offset += len(results)
+            if len(results) < size or offset >= page.get('total_count', 0):
+                break
+
+    def list_records(self, dataset, select=None, where=None, order_by=None, conditional=False):
+        """All records of a query as a list. With 'conditional', NOT_MODIFIED
+        is returned when the server reports that nothing changed (only trusted
+        when the previous result fitted in a single page)."""
+        query = dict(select=select, where=where, order_by=order_by)
+        key = (dataset, json.dumps(query, sort_keys=True))
+        first_page = self.get_records_page(dataset, conditional=conditional, **query)
+        if first_page is NOT_MODIFIED:
+            if self._total_counts.get(key, MAX_PAGE_SIZE + 1) <= MAX_PAGE_SIZE:
+                return NOT_MODIFIED
+            first_page = self.get_records_page(dataset, **query)
+        records = list(first_page.get('results', []))
+        total_count = first_page.get('total_count', len(records))
+        offset = len(records)
+        while offset < total_count:
+            results = self.get_records_page(dataset, offset, **query).get('results', [])
+            if not results:
+                break
+            records.extend(results)
+            offset += len(results)
+        self._total_counts[key] = total_count
+        return records
+
+    # -------------------------------------------------------------------------
+    # Exports endpoint
+    # -------------------------------------------------------------------------
+    def _export_response(self, dataset, export_format, **query):
+        response = self.api_client.get(self._dataset_url(dataset, f'exports/{export_format}'),
+                                       self._query(**query), conditional=False, stream=True)
+        response.raise_for_status()
+        return response
+
+    def iter_export(self, dataset, select=None, where=None, order_by=None):
+        """Yield all records of a query from the (unpaginated) jsonl export,
+        parsing the response line by line while it is downloaded."""
+        response = self._export_response(dataset, 'jsonl', select=select, where=where, order_by=order_by)
+        with response:
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def download_export(self, dataset, export_format, path, select=None, where=None, chunk_size=64 * 1024):
+        """Stream an export (e.g. 'geojson' or 'csv') to a file."""
+        response = self._export_response(dataset, export_format, select=select, where=where)
+        with response, open(path, 'wb') as export_file:
+            for chunk in response.iter_content(chunk_size):
+                export_file.write(chunk)
+        return path
@@ -1,62 +1,53 @@
 import dash
-from dash import html, dcc
-from dash.dependencies import Output, Input
-
-import pandas as pd
+from dash import html, dcc, Patch
+from dash.dependencies import Output, Input, State, ClientsideFunction
+from dash.exceptions import PreventUpdate
 
 import plotly.express as px
 
-import requests
-
-
 import os 
 import json
-from datetime import datetime
+import threading
 
-import locale
+import flask
 
-# Set Belgium time (for Dutch-language indicators of last update time)
-locale.setlocale(locale.LC_TIME, 'nl_BE.utf-8')
+import numpy as np
 
-# =============================================================================
-# Fetch data
-# =============================================================================
+from figure_cache import figure_cache
+from forecast import HORIZONS, forecast_available, profile_cache
+from ingest import fetch_data, request_refresh, start_background_poller
+from metrics import FIGURE_BUILD_SECONDS, register_metrics_route
+from profiling import register_profiling
+from snapshot_cache import get_last_update_text, snapshot_cache
+from push import notifier, register_push_route
+from static_export import register_static_export
+from snapshot_store import DATA_DIR, DATA_FILE
 
-# Fetching data function
-def fetch_data():
-    url = "https://data.stad.gent/api/explore/v2.1/catalog/datasets/bezetting-parkeergarages-real-time/records?limit=20"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()    
-        # Filter out the row with name "Loop"
-        filtered_data = [record for record in data.get("results", []) if record.get("name") != "The Loop"]
-        
-		# Write new data to file
-        with open('../data/fetched_data.json', 'w') as json_file:
-            json.dump(filtered_data, json_file)  
-		
-
-		# Get the current time and update time file
-        current_time = datetime.now().strftime("%d %B %Y - %H:%M:%S")
-        with open('../data/last_update.txt', 'w') as update_file:
-            update_file.write(current_time)
-		
-    else:
-        print("Failed to fetch data")
-        
 # =============================================================================
 # Initialize data and app
 # =============================================================================
-# Fetch data
-	### OPTION 1 ###
-	# Fetch data file if it is not yet present
-if not os.path.exists("../data/fetched_data.json"):
+# Importing this module only loads the modules and the (small) zone traces:
+# with gunicorn's preload_app (see gunicorn_config.py) that happens once in
+# the master and is shared by all workers. Figures are built on first use,
+# and the background threads are started in each worker after the fork.
+
+# Fetch data file if it is not yet present. Afterwards the data is refreshed
+# by the background poller (see ingest.py), never from within a callback.
+if not os.path.exists(DATA_FILE):
     fetch_data()
-	### OPTION 2 ###
-	# Fetch data again on each time opening webpage
-#fetch_data()
 
 
+_background_lock = threading.Lock()
+
+def start_background_threads():
+    """Start the poller (only the worker that holds the ingest lock fetches)
+    and the snapshot notifier of the server push. Threads do not survive a
+    fork, so this runs in every worker (gunicorn's post_worker_init hook, or
+    the first request), never at import."""
+    with _background_lock:
+        start_background_poller()
+        notifier.start()
+
 
 # Initialize the Dash app
 app = dash.Dash(__name__, 
@@ -69,30 +60,15 @@ app.title = "Beschikbaarheid parkeergarages Gent"
 #     # Run the data_fetch.py file to fetch the data
 #     os.system('python3 data_fetch.py')
 
-# Perform initial read-in of the filtered JSON file
-with open('../data/fetched_data.json', 'r') as json_file:
-    data = json.load(json_file)
-# Transform to dataframe for easier handling
-df = pd.DataFrame(data)
+# Start the background threads at the latest on the first request
+app.server.before_request(start_background_threads)
 
 
 # =============================================================================
-# # Function to get the last modification time of the JSON file
+# Function to update graph (parkings)
 # =============================================================================
 
-def get_last_update_time(file_path):
-    if os.path.exists(file_path):
-        with open(file_path, 'r') as update_file:
-            last_update = update_file.read().strip()
-        return f"Laatste update: {last_update}"
-    else:
-        return "Laatste update: onbekend"
-
-# =============================================================================
-# Function to update graph
-# =============================================================================
-
-def update_graph():
+def update_parkings(df):
     # Create a hovertemplate
     hover_template = "<b>%{hovertext}</b><br>" + \
                      "Beschikbare plaatsen: %{customdata[1]}<br>" + \
@@ -101,8 +77,8 @@ def update_graph():
     # Create a map figure using Plotly Express
     fig = px.scatter_mapbox(
         df,
-        lat=df["location"].apply(lambda x: x['lat']),
-        lon=df["location"].apply(lambda x: x['lon']),
+        lat="lat",
+        lon="lon",
         color="availablecapacity",
         size="totalcapacity",
         hover_name="name",
@@ -138,48 +114,220 @@ def update_graph():
     fig.update_layout(
         margin=dict(l=0, r=0, t=0, b=0),
 		coloraxis_showscale=False,
+        uirevision='map',  # Keep zoom and position of the user when the figure is updated
         )
     
     return fig
 
 
 # =============================================================================
-# Define app layout
+# Function to show the forecast of the parkings
+# =============================================================================
+
+@FIGURE_BUILD_SECONDS.labels('forecast').time()
+def get_forecast_map(df):
+    # Color the garages by the expected availability after the first horizon
+    forecast = forecast_available(df)
+    forecast_df = df.copy()
+    forecast_df['availablecapacity'] = forecast[:, 0]
+    fig = update_parkings(forecast_df)
+    
+    # Show the current availability and the forecast for each horizon on hover
+    hover_template = "<b>%{hovertext}</b><br>" + \
+                     "Nu beschikbaar: %{customdata[1]}<br>" + \
+                     "".join(f"Verwacht over {hours} uur: %{{customdata[{index + 3}]}}<br>"
+                             for index, hours in enumerate(HORIZONS)) + \
+                     "Totaal aantal plaatsen: %{marker.size}"
+    customdata = np.column_stack([df[['name', 'availablecapacity', 'totalcapacity']].values,
+                                  forecast.astype(int)])
+    fig.update_traces(hovertemplate=hover_template, customdata=customdata)
+    
+    return fig
+
+
 # =============================================================================
+# Function to update trace (parking zones)
+# =============================================================================
+# The zone traces are prebuilt offline by
+# code/parking_zones_ghent_code-saving_zones_traces.py, so the web workers do
+# not need GeoPandas (nor Plotly Express) for the zones.
+ZONES_TRACES_FILE = os.path.join(DATA_DIR, 'parking_zones_ghent-traces.json')
+ZONES_TRACES_FORMAT_VERSION = 2
+
+def load_parking_zones():
+    with open(ZONES_TRACES_FILE, 'r') as traces_file:
+        parking_zones = json.load(traces_file)
+    if parking_zones.get('format_version') != ZONES_TRACES_FORMAT_VERSION:
+        raise RuntimeError(f"{ZONES_TRACES_FILE} has an unsupported format, rebuild it with "
+                           "code/parking_zones_ghent_code-saving_zones_traces.py")
+    return parking_zones
 
-# Define the app layout, using CSS Bootstrap
-app.layout = html.Div([
-    html.Link(rel='stylesheet', href='assets/styles.css'),  # Your custom CSS link
-    html.Link(rel='stylesheet', href='https://stackpath.bootstrapcdn.com/bootstrap/4.5.2/css/bootstrap.min.css'),  # Bootstrap CSS link
+parking_zones = load_parking_zones()
 
-    html.Div(className='container mt-4', children=[
-        html.H1(className='text-center', children="Beschikbaarheid parkeergarages Gent"),
 
-        html.P(className='text-center', children="Beschikbaarheid van de verschillende parkeergarages binnen het Gentse stadscentrum."),
+def get_zones_level(zoom):
+    """Index of the finest level of detail of the zones for the given map
+    zoom. The coarsest level (index 0) is used at city zoom."""
+    level = 0
+    for index, level_of_detail in enumerate(parking_zones['levels']):
+        if zoom >= level_of_detail['min_zoom']:
+            level = index
+    return level
+
+
+# =============================================================================
+# Function to get the figure with all views (cached per snapshot)
+# =============================================================================
+# The browser gets one figure with the traces of all views; switching between
+# views only toggles the visibility of the traces (clientside, see
+# assets/views.js), without a roundtrip to the server.
+
+# Traces ('meta' of each trace) shown per display option, and whether hover
+# labels are shown
+VIEWS = {
+    'parkings': {'traces': ['parkings'], 'hovermode': 'closest'},
+    'parkings-forecast': {'traces': ['forecast'], 'hovermode': 'closest'},
+    'parking-zones': {'traces': ['zones'], 'hovermode': False},
+    'parkings_AND_parking-zones': {'traces': ['parkings', 'zones'], 'hovermode': False},
+}
+
+
+@FIGURE_BUILD_SECONDS.labels('all').time()
+def build_figure(df, zones_level=0):
+    # Timed here: get_forecast_map() builds on update_parkings() as well, and
+    # is timed as 'forecast' on its own
+    with FIGURE_BUILD_SECONDS.labels('parkings').time():
+        fig = update_parkings(df)
+    fig.update_traces(meta='parkings')
+    
+    # Forecast: own color axis, as its color range differs from the parkings
+    forecast_fig = get_forecast_map(df)
+    forecast_fig.update_traces(meta='forecast', marker_coloraxis='coloraxis2')
+    fig.add_traces(forecast_fig.data)
+    fig.update_layout(coloraxis2=forecast_fig.layout.coloraxis)
+    
+    # Parking zones
+    fig.add_traces(parking_zones['levels'][zones_level]['traces'])
+    fig.update_traces(meta='zones', selector=dict(type='choroplethmapbox'))
+    
+    fig.update_layout(meta={'views': VIEWS})
+    return fig
+
 
-        html.Div(className='d-flex justify-content-between align-items-center flex-wrap', children=[ # Make button and update indicator more compact
-            html.Div(id='last-update-time', className='text-center pt-3 pb-2', children=get_last_update_time('../data/last_update.txt')),
+def get_figure_key(snapshot, zones_level=0):
+    # The forecast also changes when the profiles are refitted
+    return snapshot['version'], (zones_level, profile_cache.get()[0])
+
+
+def get_figure_state(snapshot, zones_level=0):
+    # What the browser needs to know to tell whether its figure is outdated
+    version, (_, profiles_version) = get_figure_key(snapshot, zones_level)
+    return {'version': version, 'profiles': profiles_version, 'garages': snapshot['garages']}
+
+
+def get_figure(snapshot, zones_level=0):
+    # The figure is only built once per snapshot version, for all sessions
+    version, variant = get_figure_key(snapshot, zones_level)
+    return figure_cache.get(version, variant, lambda: build_figure(snapshot['df'], zones_level))
+
+
+def show_view(figure, display_option):
+    """Copy of 'figure' showing the traces of one display option (the same as
+    assets/views.js does in the browser)."""
+    view = VIEWS.get(display_option, VIEWS['parkings'])
+    data = [dict(trace, visible=trace.get('meta') in view['traces']) for trace in figure['data']]
+    return dict(figure, data=data, layout=dict(figure['layout'], hovermode=view['hovermode']))
+
+
+def get_figure_patch(figure, zones_changed=False):
+    """Partial update bringing a figure (with the same garages) up to date
+    with 'figure': between snapshots only the garage markers, their hover data
+    and the color ranges change, and zooming only changes the zone geometry."""
+    patch = Patch()
+    for index, trace in enumerate(figure['data']):
+        if trace['type'] == 'scattermapbox':
+            patch['data'][index]['marker']['color'] = trace['marker']['color']
+            patch['data'][index]['marker']['size'] = trace['marker']['size']
+            patch['data'][index]['marker']['sizeref'] = trace['marker']['sizeref']
+            patch['data'][index]['customdata'] = trace['customdata']
+        elif zones_changed:
+            patch['data'][index]['geojson'] = trace['geojson']
+    for coloraxis in ('coloraxis', 'coloraxis2'):
+        patch['layout'][coloraxis]['cmin'] = figure['layout'][coloraxis]['cmin']
+        patch['layout'][coloraxis]['cmax'] = figure['layout'][coloraxis]['cmax']
+    return patch
+
+
+# =============================================================================
+# Define app layout
+# =============================================================================
+
+# Display options of the dropdown (the keys of VIEWS)
+DISPLAY_OPTIONS = [
+    {'label': 'Parkeergarages', 'value': 'parkings'},
+    {'label': 'Parkeergarages (verwachting)', 'value': 'parkings-forecast'},
+    {'label': 'Parkeertariefzones', 'value': 'parking-zones'},
+    {'label': 'Parkeergarages en parkeertariefzones', 'value': 'parkings_AND_parking-zones'},
+]
+
+# Define the app layout, using CSS Bootstrap. The layout is built per page load
+# from the latest snapshot (the figure itself comes from the figure cache).
+def serve_layout():
+    if not flask.has_request_context():
+        # Dash validates the layout when it is set (at import): only the
+        # components matter then, the figure is built on the first page load
+        last_update, figure, figure_state = None, {}, None
+    else:
+        # Latest snapshot (kept in a per-worker cache)
+        snapshot = snapshot_cache.get()
+        last_update = get_last_update_text(snapshot)
+        figure = show_view(get_figure(snapshot), 'parkings')
+        figure_state = get_figure_state(snapshot)
+    return html.Div([
+        html.Link(rel='stylesheet', href='assets/styles.css'),  # Your custom CSS link
+        html.Link(rel='stylesheet', href='https://stackpath.bootstrapcdn.com/bootstrap/4.5.2/css/bootstrap.min.css'),  # Bootstrap CSS link
+
+        html.Div(className='container mt-4', children=[
+            html.H1(className='text-center', children="Beschikbaarheid parkeergarages Gent"),
+
+            html.P(className='text-center', children="Beschikbaarheid van de verschillende parkeergarages binnen het Gentse stadscentrum."),
+
+            html.Div(className='d-flex justify-content-between align-items-center flex-wrap', children=[ # Make button and update indicator more compact
+                html.Div(id='last-update-time', className='text-center pt-3 pb-2', children=last_update),
         
-            html.Div(className='text-center', children=[
-                html.Button("Update", id="refresh-btn", className='btn btn-primary mt-3 mb-3'),
-                dcc.Interval(id='refresh-interval-component', interval=10*60*1000, n_intervals=0)
+                html.Div(className='text-center', children=[
+                    html.Button("Update", id="refresh-btn", className='btn btn-primary mt-3 mb-3'),
+                    # Clicked by assets/push.js when a new snapshot is published
+                    html.Button(id='push-trigger', style={'display': 'none'}),
+                ]),
             ]),
-        ]),
         
-        html.Div(className='graph-container custom-graph-container', children=[ # Add custom-graph-container next to standard Bootstrap CSS style
-            dcc.Graph(id='live-update-graph', figure=update_graph()),
-            dcc.Interval(id='update-graph-interval', interval=1*1000, n_intervals=0)
-        ]),
-
-        html.Footer(className='text-center', children=html.P([
-            "De gegevens zijn beschikbaar via ",
-            html.A("Stad Gent API", href="https://data.stad.gent/explore/dataset/bezetting-parkeergarages-real-time/table/?sort=-occupation"),
-            ". De onderliggende code is beschikbaar op ",
-            html.A("GitHub", href="https://github.com/NT131/parkeergarages_gent"),
-            "."
-        ]))
+            html.Div(className='graph-container custom-graph-container', children=[ # Add custom-graph-container next to standard Bootstrap CSS style
+                # Dropdown for selecting display option
+                dcc.Dropdown(
+                    id='display-option',
+                    options=DISPLAY_OPTIONS,
+                    value='parkings',  # Set default value
+                    multi=False  # Allow only one option to be selected
+                ),
+                # Graph
+                dcc.Graph(id='live-update-graph', figure=figure),
+                dcc.Store(id='zones-level', data=0),  # Level of detail of the zones shown
+                dcc.Store(id='figure-state', data=figure_state),  # Which figure the browser shows
+            ]),
+
+            html.Footer(className='text-center', children=html.P([
+                "De gegevens zijn beschikbaar via ",
+                html.A("Stad Gent API", href="https://data.stad.gent/explore/dataset/bezetting-parkeergarages-real-time/table/?sort=-occupation"),
+                ". De onderliggende code is beschikbaar op ",
+                html.A("GitHub", href="https://github.com/NT131/parkeergarages_gent"),
+                "."
+            ]))
+        ])
     ])
-])
+
+
+app.layout = serve_layout
 
 
 # =============================================================================
@@ -187,25 +335,83 @@ app.layout = html.Div([
 # =============================================================================
 
 @app.callback(
-    Output('refresh-interval-component', 'disabled'),
-    Output('refresh-interval-component', 'n_intervals'),
     Output('live-update-graph', 'figure'),
     Output('last-update-time', 'children'),  # Output to update last-update-time Div
-    Input('refresh-interval-component', 'n_intervals'),
-    Input('refresh-btn', 'n_clicks')
+    Output('zones-level', 'data'),
+    Output('figure-state', 'data'),
+    Input('push-trigger', 'n_clicks'),
+    Input('refresh-btn', 'n_clicks'),
+    Input('live-update-graph', 'relayoutData'),  # Zooming in/out on the map
+    State('display-option', 'value'),
+    State('zones-level', 'data'),
+    State('figure-state', 'data')
 )
-def update_data(interval_n, btn_n):
-    fetch_data()
+def update_data(push_n, btn_n, relayout_data, display_option, zones_level, figure_state):
+    zones_changed = False
+    if dash.callback_context.triggered_id == 'refresh-btn':
+        # Fetch fresh data, shared with all other clicks (bounded wait)
+        request_refresh()
+    elif dash.callback_context.triggered_id == 'live-update-graph':
+        # Only update the figure when zooming requires an other level of
+        # detail of the zones, and the zones are shown
+        zoom = (relayout_data or {}).get('mapbox.zoom')
+        if zoom is None or get_zones_level(zoom) == zones_level:
+            raise PreventUpdate
+        if 'zones' not in VIEWS.get(display_option, VIEWS['parkings'])['traces']:
+            raise PreventUpdate
+        zones_level = get_zones_level(zoom)
+        zones_changed = True
     
-    # Read the updated JSON file
-    with open('../data/fetched_data.json', 'r') as json_file:
-        data = json.load(json_file)
-    df = pd.DataFrame(data)
+    # Read the latest snapshot published by the poller (only re-parsed when
+    # a new snapshot was published)
+    snapshot = snapshot_cache.get()
     
-    # Update last update time content after fetching data
-    last_update_time = get_last_update_time('../data/last_update.txt')
+    new_figure_state = get_figure_state(snapshot, zones_level)
     
-    return True, 0, update_graph(), last_update_time
+    if figure_state and figure_state['garages'] == new_figure_state['garages']:
+        # The browser already has a figure of the same garages: send nothing
+        # if nothing changed, only the changed values otherwise
+        if figure_state == new_figure_state and not zones_changed:
+            figure = dash.no_update
+        else:
+            figure = get_figure_patch(get_figure(snapshot, zones_level), zones_changed)
+    else:
+        figure = show_view(get_figure(snapshot, zones_level), display_option)
+    
+    return figure, get_last_update_text(snapshot), zones_level, new_figure_state
+
+
+# Switching views happens in the browser (assets/views.js)
+app.clientside_callback(
+    ClientsideFunction(namespace='parkings', function_name='show_view'),
+    Output('live-update-graph', 'figure', allow_duplicate=True),
+    Input('display-option', 'value'),
+    State('live-update-graph', 'figure'),
+    prevent_initial_call=True
+)
+
+# =============================================================================
+# Server push of new snapshots
+# =============================================================================
+# Browsers are notified of new snapshots over '<prefix>/events' (see push.py)
+register_push_route(app)
+
+# =============================================================================
+# Metrics
+# =============================================================================
+# Prometheus metrics on '<prefix>/metrics' (see metrics.py)
+register_metrics_route(app)
+
+# Opt-in sampling profiler of the callbacks (PARKINGS_PROFILE_RATE, see profiling.py)
+register_profiling(app)
+
+# =============================================================================
+# Static export
+# =============================================================================
+# With PARKINGS_EXPORT_DIR set, every new snapshot is also rendered to static
+# files that nginx serves without Python (see static_export.py). This app then
+# only serves the interactive version, on '<prefix>live'.
+register_static_export()
 
 # =============================================================================
 # Run app
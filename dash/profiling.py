@@ -0,0 +1,154 @@
+"""
+Opt-in sampling profiler for the Dash callbacks.
+
+Enabled with an environment variable (off by default, and then nothing is
+registered at all):
+
+    PARKINGS_PROFILE_RATE=0.1        fraction of the callback requests profiled
+    PARKINGS_PROFILE_INTERVAL=5      sampling interval in milliseconds (CPU time)
+    PARKINGS_PROFILE_DIR=...         output folder (default '../data/profiles')
+
+A profiled request is sampled with a SIGPROF timer: every interval the stack
+of the request is recorded, nothing is traced in between. The stacks are
+written per callback and per worker in the collapsed ("folded") format,
+ready for flamegraph.pl or speedscope:
+
+    cat ../data/profiles/live-update-graph.figure.*.folded | sort | flamegraph.pl > update_data.svg
+
+In profiling mode every response also gets a Server-Timing header with its
+duration (shown in the network tab of the browser's developer tools).
+"""
+import os
+import random
+import re
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import request
+
+from metrics import callback_name
+from snapshot_store import DATA_DIR, atomic_write
+
+try:
+    import greenlet
+except ImportError:  # only used to tell gevent requests apart
+    greenlet = None
+
+# =============================================================================
+# Settings
+# =============================================================================
+PROFILE_RATE = float(os.environ.get('PARKINGS_PROFILE_RATE', 0))
+PROFILE_INTERVAL = float(os.environ.get('PARKINGS_PROFILE_INTERVAL', 5)) / 1000
+PROFILE_DIR = os.environ.get('PARKINGS_PROFILE_DIR', os.path.join(DATA_DIR, 'profiles'))
+
+# =============================================================================
+# Sampler
+# =============================================================================
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Profile:
+    """Samples of one request."""
+    def __init__(self, name):
+        self.name = name
+        current = greenlet.getcurrent() if greenlet is not None else None
+        # With gevent, each request is a greenlet (in the main thread)
+        self.greenlet = current if current is not None and current.parent is not None else None
+        self.thread_id = None if self.greenlet is not None else threading.get_ident()
+        self.stacks = Counter()
+
+
+class Sampler:
+    """Records the stacks of the requests being profiled on every SIGPROF.
+    The timer only runs while at least one request is profiled."""
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._active = []
+        self._totals = {}  # callback name -> Counter of stacks (this process)
+        signal.signal(signal.SIGPROF, self._sample)
+
+    def _sample(self, signum, frame):
+        # Runs in the main thread, interrupting 'frame'. With gevent all
+        # requests run in the main thread: only the interrupted greenlet counts.
+        for profile in list(self._active):
+            if profile.greenlet is not None:
+                if greenlet.getcurrent() is not profile.greenlet:
+                    continue
+                stack_frame = frame
+            elif profile.thread_id == threading.main_thread().ident:
+                stack_frame = frame
+            else:
+                stack_frame = sys._current_frames().get(profile.thread_id)
+            stack = []
+            while stack_frame is not None:
+                stack.append(frame_label(stack_frame))
+                stack_frame = stack_frame.f_back
+            if stack:
+                profile.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self, name):
+        profile = Profile(name)
+        with self._lock:
+            self._active.append(profile)
+            if len(self._active) == 1:
+                signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        return profile
+
+    def stop(self, profile):
+        with self._lock:
+            self._active.remove(profile)
+            if not self._active:
+                signal.setitimer(signal.ITIMER_PROF, 0)
+            totals = self._totals.setdefault(profile.name, Counter())
+            totals.update(profile.stacks)
+            folded = ''.join(f"{stack} {count}\n" for stack, count in totals.items())
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        file_name = re.sub(r'[^\w.-]', '_', profile.name)
+        atomic_write(os.path.join(PROFILE_DIR, f"{file_name}.{os.getpid()}.folded"), folded)
+
+# =============================================================================
+# Registration
+# =============================================================================
+
+def register_profiling(app):
+    """Profile a fraction of the callback requests of a Dash app and add
+    Server-Timing headers, if PARKINGS_PROFILE_RATE is set."""
+    if PROFILE_RATE <= 0:
+        return None
+    sampler = Sampler()
+    server = app.server
+    update_path = app.config.routes_pathname_prefix + '_dash-update-component'
+
+    @server.before_request
+    def start_profile():
+        request.environ['parkings.profile_start'] = time.perf_counter()
+        if request.path == update_path and random.random() < PROFILE_RATE:
+            name = callback_name(app, request.get_json(silent=True))
+            request.environ['parkings.profile'] = sampler.start(name)
+
+    @server.after_request
+    def stop_profile(response):
+        profile = request.environ.pop('parkings.profile', None)
+        start = request.environ.get('parkings.profile_start', time.perf_counter())
+        timing = f"app;dur={(time.perf_counter() - start) * 1000:.1f}"
+        if profile is not None:
+            sampler.stop(profile)
+            timing += f', profile;desc="{sum(profile.stacks.values())} samples"'
+        response.headers['Server-Timing'] = timing
+        return response
+
+    @server.teardown_request
+    def stop_failed_profile(error):
+        # A request that raised never reaches after_request
+        profile = request.environ.pop('parkings.profile', None)
+        if profile is not None:
+            sampler.stop(profile)
+
+    return sampler
@@ -0,0 +1,106 @@
+"""
+Server push of new snapshots (Server-Sent Events).
+
+Instead of every browser polling the server on an interval, browsers keep an
+EventSource connection open on '<app prefix>/events' and are told the version
+of every new snapshot. Only then they ask for the (cached) figure update.
+
+One watcher thread per worker checks the snapshot manifest once per second
+(a single stat) and wakes up all waiting connections when it changes, or
+when the data becomes stale (so the browsers can show a warning); idle
+connections cost nothing but a heartbeat every HEARTBEAT_INTERVAL seconds.
+Many open connections per worker require an asynchronous worker class
+(gunicorn -k gevent), see gunicorn_parkings_ghent.service.
+"""
+import os
+import threading
+import time
+
+from flask import Response, stream_with_context
+
+from snapshot_cache import is_stale
+from snapshot_store import MANIFEST_FILE, current_version
+
+# =============================================================================
+# Settings
+# =============================================================================
+WATCH_INTERVAL = 1
+# Comment lines keep the connection open through nginx (proxy_read_timeout)
+HEARTBEAT_INTERVAL = 30
+# Milliseconds before the browser reconnects after the connection dropped
+RECONNECT_DELAY = 10 * 1000
+
+# =============================================================================
+# Snapshot watcher
+# =============================================================================
+
+def version_token(version, stale):
+    """What the browsers are told: the snapshot version, marked when stale."""
+    return f"{version}-stale" if stale else f"{version}"
+
+
+class SnapshotNotifier:
+    def __init__(self, path=MANIFEST_FILE):
+        self.path = path
+        self.version = version_token(current_version(), is_stale())
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, name='snapshot-notifier', daemon=True)
+            self._thread.start()
+
+    def _watch(self):
+        last_mtime = None
+        snapshot_version = None
+        while True:
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                mtime = None
+            if mtime != last_mtime:
+                last_mtime = mtime
+                snapshot_version = current_version()
+            version = version_token(snapshot_version, is_stale())
+            if version != self.version:
+                with self._condition:
+                    self.version = version
+                    self._condition.notify_all()
+            time.sleep(WATCH_INTERVAL)
+
+    def wait_for_change(self, version, timeout):
+        """Block until the version differs from 'version' or the timeout
+        passed. Returns the current version."""
+        with self._condition:
+            self._condition.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+
+notifier = SnapshotNotifier()
+
+# =============================================================================
+# Event stream route
+# =============================================================================
+
+def event_stream():
+    version = notifier.version
+    yield f"retry: {RECONNECT_DELAY}\ndata: {version}\n\n"
+    while True:
+        new_version = notifier.wait_for_change(version, HEARTBEAT_INTERVAL)
+        if new_version != version:
+            version = new_version
+            yield f"data: {version}\n\n"
+        else:
+            yield ": heartbeat\n\n"
+
+
+def register_push_route(app):
+    """Add the '<app prefix>/events' route to the Flask server of a Dash app.
+    The notifier thread is started separately, in each worker (notifier.start())."""
+
+    @app.server.route(app.config.routes_pathname_prefix + 'events')
+    def snapshot_events():
+        return Response(stream_with_context(event_stream()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache',
+                                 'X-Accel-Buffering': 'no'})  # no buffering by nginx
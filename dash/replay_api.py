@@ -0,0 +1,324 @@
+"""
+Local replay server standing in for the Stad Gent open data API.
+
+Serves recorded snapshots on the same URL paths as data.stad.gent (Explore
+API v2.1), so fetching, benchmarks, load tests and failure modes can be run
+offline:
+
+    .../catalog/datasets/bezetting-parkeergarages-real-time/records
+    .../catalog/datasets/bezetting-parkeergarages-real-time/exports/{json,jsonl}
+    .../catalog/datasets/parkeertariefzones-gent/exports/geojson
+
+The garages start from 'fetched_data.json' in the data folder (or cycle
+through the recorded snapshots in a folder), the zones come from
+'parkeertariefzones-gent.geojson' in the data folder (PARKINGS_DATA_DIR, see
+snapshot_store.py). Optionally the server adds latency,
+fails a fraction of the requests (503 or a hanging response), lets the
+occupancy drift over time and answers conditional requests (ETag and
+Last-Modified) with 304 Not Modified.
+
+    python3 replay_api.py --port 5050 --latency 0.2 --error-rate 0.05 --drift 0.02
+    PARKINGS_API_URL=http://127.0.0.1:5050/api/explore/v2.1 python3 ingest.py
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from snapshot_store import DATA_DIR, DATA_FILE
+
+ZONES_FILE = os.path.join(DATA_DIR, 'parkeertariefzones-gent.geojson')
+
+API_PREFIX = '/api/explore/v2.1/catalog/datasets/'
+GARAGES_DATASET = 'bezetting-parkeergarages-real-time'
+ZONES_DATASET = 'parkeertariefzones-gent'
+
+# ODSQL conditions understood in 'where': field = "value" / field != 'value',
+# joined with 'and'
+WHERE_CONDITION = re.compile(r'''^\s*(\w+)\s*(!=|=)\s*(?:"([^"]*)"|'([^']*)')\s*$''')
+
+# =============================================================================
+# Replayed data
+# =============================================================================
+
+class ReplayData:
+    """The garage records served at a given moment: a recorded snapshot (the
+    next one every 'snapshot_interval' seconds) with optional drift of the
+    occupancy (a random walk of 'drift' times the capacity per step, one step
+    every 'drift_interval' seconds; 0 means a step for every request)."""
+    def __init__(self, snapshots, snapshot_interval=60, drift=0.0, drift_interval=60, seed=0):
+        self.snapshots = snapshots
+        self.snapshot_interval = snapshot_interval
+        self.drift = drift
+        self.drift_interval = drift_interval
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._snapshot_index = 0
+        self._records = [dict(record) for record in snapshots[0]]
+        self._steps = 0
+        self.modified = time.time()
+
+    def records(self):
+        with self._lock:
+            now = time.time()
+            index = int((now - self._started) // self.snapshot_interval) % len(self.snapshots) \
+                if self.snapshot_interval else 0
+            if index != self._snapshot_index:
+                self._snapshot_index = index
+                self._records = [dict(record) for record in self.snapshots[index]]
+                self.modified = now
+            if self.drift:
+                steps = (int((now - self._started) // self.drift_interval) if self.drift_interval
+                         else self._steps + 1)
+                for _ in range(steps - self._steps):
+                    self._step(now)
+                self._steps = max(self._steps, steps)
+            return self._records
+
+    def _step(self, now):
+        lastupdate = datetime.fromtimestamp(now, tz=timezone.utc).astimezone().isoformat(timespec='seconds')
+        for record in self._records:
+            total = record.get('totalcapacity') or 0
+            if not total:
+                continue
+            change = round(self._random.gauss(0, self.drift * total))
+            available = min(total, max(0, (record.get('availablecapacity') or 0) + change))
+            record['availablecapacity'] = available
+            record['occupation'] = round(100 * (total - available) / total)
+            record['lastupdate'] = lastupdate
+        self.modified = now
+
+
+def load_snapshots(path):
+    """Recorded snapshots: a JSON file with a list of records, or a folder of
+    such files (replayed in name order)."""
+    if os.path.isdir(path):
+        paths = [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith('.json')]
+    else:
+        paths = [path]
+    snapshots = []
+    for snapshot_path in paths:
+        with open(snapshot_path, 'r') as snapshot_file:
+            snapshots.append(json.load(snapshot_file))
+    return snapshots
+
+# =============================================================================
+# Queries
+# =============================================================================
+
+class BadQuery(ValueError):
+    pass
+
+
+def apply_query(records, params):
+    """Apply the 'where', 'order_by' and 'select' parameters (the subset of
+    ODSQL used by this project)."""
+    where = params.get('where')
+    if where:
+        for condition in re.split(r'\s+and\s+', where, flags=re.IGNORECASE):
+            match = WHERE_CONDITION.match(condition)
+            if not match:
+                raise BadQuery(f"Unsupported where clause: {condition}")
+            field, operator, double_quoted, single_quoted = match.groups()
+            value = double_quoted if double_quoted is not None else single_quoted
+            records = [record for record in records
+                       if (str(record.get(field)) == value) == (operator == '=')]
+    order_by = params.get('order_by')
+    if order_by:
+        field, _, direction = order_by.partition(' ')
+        records = sorted(records, key=lambda record: (record.get(field) is None, record.get(field)),
+                         reverse=direction.strip().lower() == 'desc')
+    select = params.get('select')
+    if select:
+        fields = [field.strip() for field in select.split(',')]
+        records = [{field: record.get(field) for field in fields} for record in records]
+    return records
+
+# =============================================================================
+# Server
+# =============================================================================
+
+class ReplayApi:
+    def __init__(self, data, zones_path=ZONES_FILE,
+                 latency=0.0, jitter=0.0, error_rate=0.0, hang_rate=0.0, hang_time=30,
+                 etag=True, last_modified=True, host='127.0.0.1', port=0, seed=0):
+        self.data = data
+        self.zones_path = zones_path
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.hang_time = hang_time
+        self.etag = etag
+        self.last_modified = last_modified
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/api/explore/v2.1"
+
+    def start(self):
+        """Serve in a background thread (for use from other scripts)."""
+        threading.Thread(target=self.server.serve_forever, name='replay-api', daemon=True).start()
+        return self
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _failure(self):
+        """None, 'error' or 'hang' for the next request."""
+        with self._lock:
+            self.requests += 1
+            draw = self._random.random()
+        if draw < self.error_rate:
+            return 'error'
+        if draw < self.error_rate + self.hang_rate:
+            return 'hang'
+        return None
+
+    def _delay(self):
+        if self.latency or self.jitter:
+            with self._lock:
+                jitter = self._random.uniform(-self.jitter, self.jitter)
+            time.sleep(max(0.0, self.latency + jitter))
+
+    def respond(self, path, params):
+        """(status, content type, body, last modified timestamp) of a GET."""
+        if not path.startswith(API_PREFIX):
+            return 404, 'application/json', _error("Unknown path"), None
+        dataset, _, endpoint = path[len(API_PREFIX):].partition('/')
+        if dataset == ZONES_DATASET and endpoint == 'exports/geojson':
+            with open(self.zones_path, 'rb') as zones_file:
+                return 200, 'application/geo+json', zones_file.read(), os.path.getmtime(self.zones_path)
+        if dataset != GARAGES_DATASET:
+            return 404, 'application/json', _error(f"Unknown dataset {dataset}"), None
+
+        try:
+            records = apply_query(self.data.records(), params)
+        except BadQuery as error:
+            return 400, 'application/json', _error(str(error)), None
+        modified = self.data.modified
+        if endpoint == 'records':
+            try:
+                limit = int(params.get('limit', 10))
+                offset = int(params.get('offset', 0))
+            except ValueError:
+                return 400, 'application/json', _error("Invalid limit or offset"), None
+            if not 0 <= limit <= 100 or offset < 0 or offset + limit > 10000:
+                return 400, 'application/json', _error("Invalid limit or offset"), None
+            body = {'total_count': len(records), 'results': records[offset:offset + limit]}
+            return 200, 'application/json', json.dumps(body).encode('utf-8'), modified
+        if endpoint == 'exports/json':
+            return 200, 'application/json', json.dumps(records).encode('utf-8'), modified
+        if endpoint == 'exports/jsonl':
+            lines = ''.join(json.dumps(record) + '\n' for record in records)
+            return 200, 'application/jsonlines', lines.encode('utf-8'), modified
+        return 404, 'application/json', _error(f"Unknown endpoint {endpoint}"), None
+
+    def _handler_class(self):
+        replay = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, as the real API
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                failure = replay._failure()
+                replay._delay()
+                if failure == 'hang':
+                    time.sleep(replay.hang_time)
+                if failure == 'error':
+                    return self._send(503, 'application/json', _error("Service unavailable (replayed)"))
+
+                url = urlparse(self.path)
+                params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                status, content_type, body, modified = replay.respond(url.path, params)
+                headers = {}
+                if status == 200:
+                    if replay.etag:
+                        headers['ETag'] = '"' + hashlib.sha1(body).hexdigest() + '"'
+                    if replay.last_modified and modified:
+                        headers['Last-Modified'] = formatdate(modified, usegmt=True)
+                    if self._not_modified(headers, modified):
+                        return self._send(304, None, b'', headers)
+                self._send(status, content_type, body, headers)
+
+            def _not_modified(self, headers, modified):
+                if_none_match = self.headers.get('If-None-Match')
+                if if_none_match is not None:
+                    return 'ETag' in headers and if_none_match == headers['ETag']
+                if_modified_since = self.headers.get('If-Modified-Since')
+                return ('Last-Modified' in headers and if_modified_since is not None
+                        and if_modified_since == headers['Last-Modified'])
+
+            def _send(self, status, content_type, body, headers=None):
+                self.send_response(status)
+                if content_type:
+                    self.send_header('Content-Type', content_type)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+def _error(message):
+    return json.dumps({'error_code': 'ReplayError', 'message': message}).encode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5050)
+    parser.add_argument('--snapshots', default=DATA_FILE,
+                        help="JSON file with the records, or a folder of recorded snapshots")
+    parser.add_argument('--snapshot-interval', type=float, default=60,
+                        help="seconds before the next recorded snapshot is served")
+    parser.add_argument('--zones', default=ZONES_FILE)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="random +/- seconds on the latency")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of 503 responses")
+    parser.add_argument('--hang-rate', type=float, default=0.0, help="fraction of hanging responses")
+    parser.add_argument('--hang-time', type=float, default=30)
+    parser.add_argument('--drift', type=float, default=0.0,
+                        help="occupancy random walk step, as a fraction of the capacity")
+    parser.add_argument('--drift-interval', type=float, default=60,
+                        help="seconds per drift step (0: a step for every request)")
+    parser.add_argument('--etag', action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument('--last-modified', action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument('--seed', type=int, default=0)
+    arguments = parser.parse_args()
+
+    data = ReplayData(load_snapshots(arguments.snapshots), arguments.snapshot_interval,
+                      arguments.drift, arguments.drift_interval, arguments.seed)
+    replay = ReplayApi(data, arguments.zones, arguments.latency, arguments.jitter, arguments.error_rate,
+                       arguments.hang_rate, arguments.hang_time, arguments.etag, arguments.last_modified,
+                       arguments.host, arguments.port, arguments.seed)
+    print(f"Replaying the Stad Gent API at {replay.base_url}")
+    try:
+        replay.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+In-process cache of the latest published snapshot.
+
+Every worker keeps the compact garage table (see garages.py), the DataFrame
+and the formatted update time of the current snapshot in memory. A single
+os.stat() of the snapshot manifest tells whether a new snapshot was
+published; only then the data is read and parsed again. In the common case,
+getting the data for a callback is a dictionary lookup.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from garages import garage_table
+from metrics import CACHE_REQUESTS, SNAPSHOT_LOAD_SECONDS
+from snapshot_store import (DATA_FILE, LAST_UPDATE_FILE, MANIFEST_FILE, STATUS_FILE,
+                            SnapshotChanged, read_ingest_status, read_snapshot)
+
+
+# The data is shown as stale when the poller did not succeed for this long
+STALE_AFTER = 15 * 60
+
+
+def format_last_update(last_update):
+    if last_update:
+        return f"Laatste update: {last_update}"
+    else:
+        return "Laatste update: onbekend"
+
+
+def garages_hash(table):
+    """Changes when garages are added to or removed from the data. The same
+    in every worker: the garages are in order of id (see GarageTable)."""
+    names = json.dumps([table.registry.names[code] for code in table.present])
+    return hashlib.sha1(names.encode('utf-8')).hexdigest()[:12]
+
+
+def _stat_key():
+    """Identify the on-disk snapshot with one stat call: the manifest if it
+    exists, the data file otherwise (data written before versioning)."""
+    for path in (MANIFEST_FILE, DATA_FILE):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        return (path, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    return None
+
+
+class SnapshotCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key = None
+        self._snapshot = None
+
+    def get(self):
+        """Return the current snapshot as a dict with keys 'version', 'table'
+        (the garages, see garages.py), 'df', 'last_update' (formatted for the
+        'last-update-time' div) and 'garages' (a short hash of the garages in
+        the snapshot, in the order of the rows of the figure)."""
+        key = _stat_key()
+        snapshot = self._snapshot
+        if snapshot is not None and key == self._key:
+            CACHE_REQUESTS.labels('snapshot', 'hit').inc()
+            return snapshot
+        with self._lock:
+            # Another thread may have refreshed while we waited for the lock
+            if self._snapshot is not None and key == self._key:
+                CACHE_REQUESTS.labels('snapshot', 'hit').inc()
+                return self._snapshot
+            CACHE_REQUESTS.labels('snapshot', 'miss').inc()
+            try:
+                with SNAPSHOT_LOAD_SECONDS.time():
+                    self._snapshot = self._load()
+            except SnapshotChanged:
+                if self._snapshot is None:
+                    raise
+                # Keep serving the previous snapshot, the next call reads again
+                return self._snapshot
+            self._key = key
+            return self._snapshot
+
+    def _load(self):
+        manifest, records = read_snapshot()
+        if manifest is not None:
+            version = manifest['version']
+            last_update = manifest.get('last_update')
+        else:
+            # Snapshot from before versioning: fall back to last_update.txt
+            version = 0
+            last_update = _read_legacy_last_update()
+        table = garage_table(records)
+        return {
+            'version': version,
+            'table': table,
+            'df': table.to_frame(),
+            'last_update': format_last_update(last_update),
+            'garages': garages_hash(table),
+        }
+
+
+def _read_legacy_last_update():
+    try:
+        with open(LAST_UPDATE_FILE, 'r') as update_file:
+            return update_file.read().strip()
+    except OSError:
+        return None
+
+
+class StatusCache:
+    """Poller status, re-read only when the status file changes (one stat)."""
+    def __init__(self):
+        self._mtime = None
+        self._status = None
+
+    def get(self):
+        try:
+            mtime = os.stat(STATUS_FILE).st_mtime_ns
+        except OSError:
+            return None
+        if mtime != self._mtime:
+            self._status = read_ingest_status()
+            self._mtime = mtime
+        return self._status
+
+
+def is_stale(now=None):
+    """Whether the poller failed to refresh the data for STALE_AFTER seconds
+    (False when there is no poller status, e.g. during development)."""
+    status = status_cache.get()
+    if not status or not status.get('last_attempt'):
+        return False
+    now = now or time.time()
+    return now - (status.get('last_success') or 0) > STALE_AFTER
+
+
+def get_last_update_text(snapshot):
+    """Text of the 'last-update-time' div: the last good snapshot is always
+    shown, with a warning when it is stale."""
+    if is_stale():
+        return f"{snapshot['last_update']} (verouderd: Stad Gent is tijdelijk niet bereikbaar)"
+    return snapshot['last_update']
+
+
+# Caches shared by all callbacks of this worker
+snapshot_cache = SnapshotCache()
+status_cache = StatusCache()
@@ -0,0 +1,152 @@
+"""
+Atomic, versioned publishing of API snapshots.
+
+Each snapshot consists of three files in the data folder:
+    - fetched_data.json: the (filtered) garage records
+    - last_update.txt: the human readable update time shown in the app
+    - snapshot_version.json: manifest with version, content hash and timestamps
+
+Files are written to a temporary file in the same folder and moved in place
+with os.replace(), so readers never see a half-written file. The manifest is
+written last and acts as the commit marker of a snapshot: readers can check
+current_version() and skip re-parsing the data when it did not change.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+# =============================================================================
+# Settings
+# =============================================================================
+# Overridable to run on a copy of the data (benchmarks, load tests)
+DATA_DIR = os.environ.get('PARKINGS_DATA_DIR',
+                          os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+DATA_FILE = os.path.join(DATA_DIR, 'fetched_data.json')
+LAST_UPDATE_FILE = os.path.join(DATA_DIR, 'last_update.txt')
+MANIFEST_FILE = os.path.join(DATA_DIR, 'snapshot_version.json')
+WRITE_LOCK_FILE = os.path.join(DATA_DIR, 'snapshot.lock')
+# Health of the poller (last attempt/success, circuit breaker), see ingest.py
+STATUS_FILE = os.path.join(DATA_DIR, 'ingest_status.json')
+
+# =============================================================================
+# Writing
+# =============================================================================
+
+def atomic_write(path, content):
+    """Write 'content' (str or bytes) to 'path' via a temporary file and an
+    atomic rename."""
+    mode = 'wb' if isinstance(content, bytes) else 'w'
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as tmp_file:
+            tmp_file.write(content)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# Seconds between two attempts to take a lock file held by another process
+LOCK_RETRY = 0.1
+
+def lock_exclusive(lock_file):
+    """Take an exclusive lock on 'lock_file', waiting for other processes.
+    A blocking flock() would freeze every greenlet of a gevent worker, so the
+    lock is tried without blocking and the wait is a (cooperative) sleep."""
+    while True:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return
+        except BlockingIOError:
+            time.sleep(LOCK_RETRY)
+
+
+def serialize_records(records):
+    return json.dumps(records).encode('utf-8')
+
+
+def content_hash(payload):
+    """SHA-256 of the serialized snapshot payload."""
+    return hashlib.sha256(payload).hexdigest()
+
+
+def publish_snapshot(records, last_update):
+    """Publish a new snapshot and return its manifest.
+
+    The version is one higher than the currently published version. Writers on
+    the same host are serialized with a lock file, so versions stay monotonic
+    even if several processes publish."""
+    payload = serialize_records(records)
+    with open(WRITE_LOCK_FILE, 'a') as lock_file:
+        lock_exclusive(lock_file)
+        previous = read_manifest()
+        manifest = {
+            'version': (previous['version'] if previous else 0) + 1,
+            'sha256': content_hash(payload),
+            'published_at': time.time(),
+            'last_update': last_update,
+            'records': len(records),
+        }
+        atomic_write(DATA_FILE, payload)
+        atomic_write(LAST_UPDATE_FILE, last_update)
+        # Manifest last: a snapshot only exists once its manifest is in place
+        atomic_write(MANIFEST_FILE, json.dumps(manifest))
+    return manifest
+
+def write_ingest_status(status):
+    atomic_write(STATUS_FILE, json.dumps(status))
+
+# =============================================================================
+# Reading
+# =============================================================================
+
+def read_ingest_status():
+    """Status written by the poller, or None if it never ran."""
+    try:
+        with open(STATUS_FILE, 'r') as status_file:
+            return json.load(status_file)
+    except (OSError, ValueError):
+        return None
+
+def read_manifest():
+    """Return the manifest of the current snapshot, or None if no snapshot was
+    published yet (e.g. data files from before versioning)."""
+    try:
+        with open(MANIFEST_FILE, 'r') as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+
+
+def current_version():
+    """Cheap lookup of the current snapshot version (0 if unknown)."""
+    manifest = read_manifest()
+    return manifest['version'] if manifest else 0
+
+
+class SnapshotChanged(RuntimeError):
+    """The snapshot kept changing while it was read."""
+
+
+def read_snapshot(retries=3, retry_delay=0.05):
+    """Return (manifest, records) of the current snapshot. The data is checked
+    against the content hash of the manifest, which also catches a read
+    between the swap of the data file and the write of its manifest; the read
+    is then retried. Raises SnapshotChanged if no read was consistent, rather
+    than returning a manifest and records of different snapshots."""
+    for attempt in range(retries):
+        manifest = read_manifest()
+        with open(DATA_FILE, 'rb') as json_file:
+            payload = json_file.read()
+        if manifest is None or content_hash(payload) == manifest['sha256']:
+            return manifest, json.loads(payload)
+        time.sleep(retry_delay * (attempt + 1))
+    raise SnapshotChanged(f"{DATA_FILE} does not match its manifest after {retries} reads")
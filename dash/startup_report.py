@@ -0,0 +1,58 @@
+"""
+Startup-time report: what importing the app costs.
+
+Imports a module (by default the app) in a fresh interpreter with
+'python -X importtime' and reports the total import time, the peak memory
+(RSS) of that interpreter and the modules with the highest cumulative import
+time:
+
+    python3 startup_report.py [module] [--top 20]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$')
+
+# Run in the child interpreter after the import: peak RSS in kB (Linux)
+REPORT_RSS = "import resource; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+
+
+def measure(module):
+    """Import 'module' in a new interpreter. Returns (list of (module, depth,
+    self µs, cumulative µs) in import order, peak RSS in kB)."""
+    env = dict(os.environ, PARKINGS_INGEST_MODE='sidecar')  # do not start the poller
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}; {REPORT_RSS}"],
+                            capture_output=True, text=True, env=env,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr[-2000:])
+    imports = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            imports.append((name, len(indent) // 2, int(self_us), int(cumulative_us)))
+    return imports, int(result.stdout.split()[-1])
+
+
+def report(module, top=20):
+    imports, max_rss = measure(module)
+    total = sum(cumulative for _, depth, _, cumulative in imports if depth == 0)
+    print(f"Import of {module}: {total / 1e6:.2f} s, {len(imports)} modules, peak RSS {max_rss / 1024:.0f} MB")
+
+    # Top level packages, as imported directly (depth 0) or by the module (depth 1)
+    print(f"\n{'cumulative (ms)':>16} {'self (ms)':>10}  module")
+    for name, depth, self_us, cumulative_us in sorted(
+            (entry for entry in imports if entry[1] <= 1), key=lambda entry: -entry[3])[:top]:
+        print(f"{cumulative_us / 1000:16.1f} {self_us / 1000:10.1f}  {'  ' * depth}{name}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('module', nargs='?', default='parkings_ghent_app_dash')
+    parser.add_argument('--top', type=int, default=20)
+    arguments = parser.parse_args()
+    report(arguments.module, arguments.top)
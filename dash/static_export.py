@@ -0,0 +1,207 @@
+"""
+Static export of the dashboard, served by nginx without Python.
+
+The page is the same for every visitor, so with PARKINGS_EXPORT_DIR set, every
+newly published snapshot is also rendered to static files in that folder:
+
+    index.html                  the page (same look as the Dash layout)
+    figure-<option>.json        the figure of each display option (see VIEWS)
+    version.json                snapshot version and update time, written last
+    page.js, styles.css, plotly-<version>.min.js
+
+Every file but index.html and version.json gets a gzipped copy (.gz) next to
+it, which nginx serves with gzip_static.
+
+nginx serves the folder (see gunicorn_and_nginx_files/mirrored_files/dashapp)
+and the page on the app URL itself. In the browser, static_page/page.js loads
+the figure of the selected display option and checks version.json every
+minute (a 304 from nginx when nothing changed). The Dash app stays available
+on '<prefix>live' for what needs Python: the Update button fetching fresh
+data, finer zones when zooming in and the warning when the data is stale.
+
+The export runs in the process that publishes the snapshot (the poller, see
+ingest.py). With the poller as a sidecar process, or to export right after
+deploying, run:
+
+    python3 static_export.py [--watch]
+"""
+import argparse
+import gzip
+import html
+import json
+import os
+import string
+import time
+
+import plotly
+
+from ingest import publish_hooks
+from snapshot_cache import snapshot_cache
+from snapshot_store import atomic_write
+
+# =============================================================================
+# Settings
+# =============================================================================
+# e.g. /home/nielstack/projects/erpohk/visualisations/visualisaties/parkeergarages-gent/static
+EXPORT_DIR = os.environ.get('PARKINGS_EXPORT_DIR')
+# URL of the export folder, relative to the URL of the app
+EXPORT_PATH = 'static/'
+# Path of the interactive (Dash) version, relative to the URL of the app
+LIVE_PATH = 'live'
+# Seconds between two checks for a new version in the browser (and --watch)
+CHECK_INTERVAL = 60
+
+DASH_DIR = os.path.dirname(os.path.abspath(__file__))
+PAGE_SCRIPT = os.path.join(DASH_DIR, 'static_page', 'page.js')
+STYLESHEET = os.path.join(DASH_DIR, 'assets', 'styles.css')
+PLOTLY_SCRIPT = os.path.join(os.path.dirname(plotly.__file__), 'package_data', 'plotly.min.js')
+PLOTLY_SCRIPT_NAME = f"plotly-{plotly.__version__}.min.js"
+
+# The Dash layout (serve_layout() in the app) as plain HTML
+PAGE_TEMPLATE = string.Template("""<!DOCTYPE html>
+<html lang="nl">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>$title</title>
+<link rel="stylesheet" href="${static_url}styles.css">
+<link rel="stylesheet" href="https://stackpath.bootstrapcdn.com/bootstrap/4.5.2/css/bootstrap.min.css">
+</head>
+<body data-version="$version" data-static-url="$static_url" data-check-interval="$check_interval">
+<div class="container mt-4">
+<h1 class="text-center">$title</h1>
+<p class="text-center">Beschikbaarheid van de verschillende parkeergarages binnen het Gentse stadscentrum.</p>
+<div class="d-flex justify-content-between align-items-center flex-wrap">
+<div id="last-update-time" class="text-center pt-3 pb-2">$last_update</div>
+<div class="text-center">
+<button id="refresh-btn" class="btn btn-primary mt-3 mb-3">Update</button>
+<a class="btn btn-link mt-3 mb-3" href="$live_url">Interactieve versie</a>
+</div>
+</div>
+<div class="graph-container custom-graph-container">
+<select id="display-option" class="custom-select">
+$options
+</select>
+<div id="live-update-graph"></div>
+</div>
+<footer class="text-center"><p>De gegevens zijn beschikbaar via <a href="https://data.stad.gent/explore/dataset/bezetting-parkeergarages-real-time/table/?sort=-occupation">Stad Gent API</a>. De onderliggende code is beschikbaar op <a href="https://github.com/NT131/parkeergarages_gent">GitHub</a>.</p></footer>
+</div>
+<script src="${static_url}$plotly_script"></script>
+<script src="${static_url}page.js"></script>
+</body>
+</html>
+""")
+
+# =============================================================================
+# Export
+# =============================================================================
+
+def read_export_state(export_dir):
+    try:
+        with open(os.path.join(export_dir, 'version.json'), 'r') as version_file:
+            return json.load(version_file)['state']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_compressed(path, data):
+    """Write 'data' (bytes), with a gzipped copy next to it (nginx'
+    gzip_static). The copy is written first: nginx never serves a stale one
+    next to a new file."""
+    atomic_write(path + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+    atomic_write(path, data)
+
+
+def write_json(path, content):
+    write_compressed(path, json.dumps(content, separators=(',', ':')).encode('utf-8'))
+
+
+def render_page(app_module, snapshot, version):
+    prefix = app_module.app.config.requests_pathname_prefix
+    options = '\n'.join(f'<option value="{html.escape(option["value"])}">{html.escape(option["label"])}</option>'
+                        for option in app_module.DISPLAY_OPTIONS)
+    return PAGE_TEMPLATE.substitute(
+        title=html.escape(app_module.app.title),
+        last_update=html.escape(snapshot['last_update'] or ''),
+        version=html.escape(version),
+        static_url=prefix + EXPORT_PATH,
+        live_url=prefix + LIVE_PATH,
+        check_interval=CHECK_INTERVAL,
+        options=options,
+        plotly_script=PLOTLY_SCRIPT_NAME,
+    )
+
+
+def export_snapshot(export_dir=EXPORT_DIR, force=False):
+    """Render the latest snapshot to 'export_dir'. Does nothing if the export
+    is already up to date (unless 'force'). Returns whether it exported."""
+    # Imported here: the app imports this module
+    import parkings_ghent_app_dash as app_module
+
+    snapshot = snapshot_cache.get()
+    state = app_module.get_figure_state(snapshot)
+    if not force and read_export_state(export_dir) == state:
+        return False
+    os.makedirs(export_dir, exist_ok=True)
+
+    # Static files, only copied (and compressed) when they changed
+    for source, name in ((PAGE_SCRIPT, 'page.js'), (STYLESHEET, 'styles.css'), (PLOTLY_SCRIPT, PLOTLY_SCRIPT_NAME)):
+        target = os.path.join(export_dir, name)
+        if not os.path.exists(target + '.gz') or os.path.getmtime(target) < os.path.getmtime(source):
+            with open(source, 'rb') as source_file:
+                write_compressed(target, source_file.read())
+
+    # The figures first and version.json last: a browser that sees the new
+    # version in version.json finds the new figures
+    figure = app_module.get_figure(snapshot)
+    for option in app_module.DISPLAY_OPTIONS:
+        write_json(os.path.join(export_dir, f"figure-{option['value']}.json"),
+                   app_module.show_view(figure, option['value']))
+    version = f"{state['version']}-{state['profiles'] or 0}"
+    atomic_write(os.path.join(export_dir, 'index.html'), render_page(app_module, snapshot, version))
+    atomic_write(os.path.join(export_dir, 'version.json'), json.dumps({
+        'version': version,
+        'last_update': snapshot['last_update'],
+        'state': state,
+    }))
+    return True
+
+
+def register_static_export():
+    """Export every newly published snapshot, if PARKINGS_EXPORT_DIR is set."""
+    if not EXPORT_DIR:
+        return
+    if export_snapshot not in publish_hooks:
+        publish_hooks.append(export_snapshot)
+
+
+def watch(export_dir, interval=5):
+    """Export whenever the snapshot (or the forecast profiles) changed, for a
+    poller running as a sidecar process."""
+    while True:
+        try:
+            export_snapshot(export_dir)
+        except Exception as error:
+            print(f"Failed to export snapshot: {error}")
+        time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--export-dir', default=EXPORT_DIR, help="default: PARKINGS_EXPORT_DIR")
+    parser.add_argument('--watch', action='store_true', help="keep exporting every new snapshot")
+    arguments = parser.parse_args()
+    if not arguments.export_dir:
+        parser.error("set PARKINGS_EXPORT_DIR or --export-dir")
+    if arguments.watch:
+        try:
+            watch(arguments.export_dir)
+        except KeyboardInterrupt:
+            pass
+    else:
+        export_snapshot(arguments.export_dir, force=True)
+        print(f"Exported to {arguments.export_dir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+/* page.js: the statically exported page (see static_export.py). Loads the
+   figure of the selected display option and checks version.json for a new
+   snapshot, all from files served by nginx. */
+(function () {
+    var body = document.body;
+    var staticUrl = body.getAttribute('data-static-url');
+    var version = body.getAttribute('data-version');
+    var graph = document.getElementById('live-update-graph');
+    var displayOption = document.getElementById('display-option');
+    var lastUpdate = document.getElementById('last-update-time');
+
+    function getJson(name) {
+        // 'no-cache': revalidate with nginx (304 when the file did not change)
+        return fetch(staticUrl + name, {cache: 'no-cache'}).then(function (response) {
+            if (!response.ok) {
+                throw new Error(name + ': ' + response.status);
+            }
+            return response.json();
+        });
+    }
+
+    function showFigure() {
+        return getJson('figure-' + displayOption.value + '.json').then(function (figure) {
+            // uirevision in the layout keeps the zoom and position of the user
+            Plotly.react(graph, figure.data, figure.layout, {responsive: true});
+        });
+    }
+
+    function checkVersion() {
+        return getJson('version.json').then(function (state) {
+            if (state.version !== version) {
+                version = state.version;
+                lastUpdate.textContent = state.last_update;
+                return showFigure();
+            }
+        });
+    }
+
+    displayOption.addEventListener('change', showFigure);
+    document.getElementById('refresh-btn').addEventListener('click', checkVersion);
+    showFigure();
+    window.setInterval(checkVersion, Number(body.getAttribute('data-check-interval')) * 1000);
+})();